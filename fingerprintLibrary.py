@@ -0,0 +1,164 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from scipy.spatial.distance import pdist, squareform
+from processDataset import SENSOR_COLUMNS
+
+DEFAULT_LIBRARY_PATH = os.getenv("FINGERPRINT_LIBRARY_PATH") or "fingerprint_library.csv"
+
+META_COLUMNS = ["Device", "Date", "Run", "Baseline", "Smell", "Name"]
+# run เดียวกัน (อุปกรณ์ / วันที่ / ช่วงเวลาของข้อมูล / baseline correction / กลิ่น) มีได้แถวเดียวในคลัง
+KEY_COLUMNS = ["Device", "Date", "Run", "Baseline", "Smell"]
+# ค่า Baseline ของ fingerprint ที่ไม่ได้ปรับ baseline (รวมถึงแถวจากคลังรุ่นก่อนที่ไม่มีคอลัมน์นี้)
+RAW_BASELINE = "raw"
+# จำนวนแถวสูงสุดของ similarity_matrix (N x N float64: 2000 แถว ~ 32 MB)
+SIMILARITY_MAX_ROWS = 2000
+
+def _unit_vectors(X):
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    return X / np.where(norms == 0, 1, norms)
+
+def _vectors(df):
+    return df[SENSOR_COLUMNS].apply(pd.to_numeric, errors='coerce').fillna(0).to_numpy(dtype='float64')
+
+def _match(df, column, value):
+    if value is None:
+        return np.ones(len(df), dtype=bool)
+    return (df[column].astype(str) == str(value)).to_numpy()
+
+class FingerprintLibrary:
+    """
+    คลัง fingerprint (ค่าเฉลี่ย s1-s8) ของทุก run แยกตาม Device / Date / Run / Baseline / Smell
+    ค่าดิบและค่าที่ปรับ baseline แต่ละแบบอยู่คนละสเกล จึงเทียบกันเฉพาะ Baseline เดียวกัน
+    - similarity_matrix: คำนวณทุกคู่ด้วย pdist (vectorized) เฉพาะกลุ่มที่เลือก ไม่เกิน SIMILARITY_MAX_ROWS แถว
+    - nearest: ค้นกลิ่นที่ใกล้ที่สุดด้วย KD-tree บน unit vector แยก tree ต่อ Baseline (ลำดับเท่ากับ cosine similarity)
+    add จะแทน self.df ด้วย DataFrame ใหม่เสมอ (ไม่แก้ของเดิม) จึงอ่าน snapshot ของ df / tree นอก lock ได้
+    """
+    def __init__(self, path=DEFAULT_LIBRARY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._trees = {}
+        # ไฟล์คลังรุ่นก่อนไม่มีคอลัมน์ Run / Baseline ต้องเขียนใหม่ทั้งไฟล์ก่อน append ครั้งแรก
+        self._rewrite = False
+        if path and os.path.exists(path):
+            self.df = pd.read_csv(path, dtype={column: str for column in META_COLUMNS})
+            self._rewrite = any(column not in self.df.columns for column in META_COLUMNS)
+            self.df = self.df.reindex(columns=META_COLUMNS + SENSOR_COLUMNS)
+            self.df['Run'] = self.df['Run'].fillna('-')
+            self.df['Baseline'] = self.df['Baseline'].fillna(RAW_BASELINE)
+        else:
+            self.df = pd.DataFrame(columns=META_COLUMNS + SENSOR_COLUMNS)
+
+    def __len__(self):
+        return len(self.df)
+
+    def add(self, average_df, device, date, run, baseline=RAW_BASELINE):
+        """
+        average_df: ตาราง Smell, Name, s1-s8 (average_smell_sensor_values.csv)
+        date: วันที่ของข้อมูลใน run (ไม่ใช่วันที่เลือกบนหน้าจอ)
+        run: รหัสของ run เช่นช่วงเวลาของข้อมูล ("08:00:00-10:30:00") เพื่อแยก run ในวันเดียวกัน
+        baseline: โหมด baseline correction ของ average_df เช่น "raw", "rolling-subtract"
+        run ที่มีอยู่แล้ว (KEY_COLUMNS เดียวกัน) จะถูกแทนที่ ไม่เพิ่มซ้ำ
+        ถ้าไม่มีแถวซ้ำจะเพิ่มต่อท้ายไฟล์ (append) ไม่เขียนคลังทั้งหมดใหม่
+        """
+        rows = average_df.reindex(columns=['Smell', 'Name'] + SENSOR_COLUMNS).copy()
+        rows = rows.dropna(subset=SENSOR_COLUMNS, how='all')
+        rows.insert(0, 'Baseline', str(baseline))
+        rows.insert(0, 'Run', str(run))
+        rows.insert(0, 'Date', str(date))
+        rows.insert(0, 'Device', str(device))
+        rows['Smell'] = rows['Smell'].astype(str)
+        rows['Name'] = rows['Name'].fillna(rows['Smell'])
+        rows = rows[META_COLUMNS + SENSOR_COLUMNS]
+        with self._lock:
+            existing = self._key_index(self.df).isin(self._key_index(rows))
+            if existing.any() or self._rewrite:
+                self.df = pd.concat([self.df[~existing], rows], ignore_index=True)
+                self._rewrite = False
+                if self.path:
+                    tmp_path = f"{self.path}.tmp"
+                    self.df.to_csv(tmp_path, index=False)
+                    os.replace(tmp_path, self.path)
+            else:
+                if self.path:
+                    write_header = not os.path.exists(self.path)
+                    rows.to_csv(self.path, mode='a', header=write_header, index=False)
+                self.df = pd.concat([self.df, rows], ignore_index=True) if len(self.df) else rows.reset_index(drop=True)
+            self._trees = {}
+        return len(rows)
+
+    @staticmethod
+    def _key_index(df):
+        return pd.MultiIndex.from_frame(df[KEY_COLUMNS].astype(str))
+
+    def vectors(self):
+        return _vectors(self.df)
+
+    def similarity_matrix(self, metric='cosine', device=None, baseline=None, max_rows=SIMILARITY_MAX_ROWS):
+        """
+        ตาราง similarity ทุกคู่ (1 - distance สำหรับ cosine, 1 / (1 + distance) สำหรับ metric อื่น)
+        device / baseline: ใช้เฉพาะแถวของอุปกรณ์ / โหมด baseline นี้ (None = ทั้งหมด)
+        ตาราง N x N โตตาม N^2 จึงใช้เฉพาะ max_rows แถวล่าสุด
+        """
+        df = self.df
+        df = df[_match(df, 'Device', device) & _match(df, 'Baseline', baseline)].tail(max_rows)
+        X = _vectors(df)
+        labels = self._labels(df)
+        if len(X) < 2:
+            return pd.DataFrame(np.ones((len(X), len(X))), index=labels, columns=labels)
+        distances = squareform(pdist(X, metric=metric))
+        similarity = 1 - distances if metric == 'cosine' else 1 / (1 + distances)
+        return pd.DataFrame(similarity.round(4), index=labels, columns=labels)
+
+    @staticmethod
+    def _labels(df):
+        return (df['Device'].astype(str) + ' | ' + df['Date'].astype(str) + ' ' + df['Run'].astype(str)
+                + ' | ' + df['Name'].astype(str)).tolist()
+
+    def labels(self):
+        return self._labels(self.df)
+
+    def _get_group(self, baseline):
+        """(tree, แถวของกลุ่ม) ของ Baseline นี้จาก df ชุดเดียวกัน (baseline=None = ทั้งคลัง)"""
+        with self._lock:
+            if baseline not in self._trees:
+                group = self.df[_match(self.df, 'Baseline', baseline)].reset_index(drop=True)
+                tree = cKDTree(_unit_vectors(_vectors(group))) if len(group) else None
+                self._trees[baseline] = (tree, group)
+            return self._trees[baseline]
+
+    def nearest(self, vectors, k=5, exclude=None, baseline=None):
+        """
+        vectors: array (n, 8) ของ fingerprint ที่ต้องการค้น
+        exclude: (device, date, run) ของ run ที่กำลังค้น เพื่อไม่ให้เจอตัวเอง (run อื่นในวันเดียวกันยังค้นเจอ)
+        baseline: ค้นเฉพาะ fingerprint ที่ใช้ baseline correction แบบเดียวกัน (None = ทั้งหมด)
+        return: DataFrame Query, Rank, Device, Date, Run, Baseline, Smell, Name, Cosine_Similarity
+        """
+        empty = pd.DataFrame(columns=['Query', 'Rank'] + META_COLUMNS + ['Cosine_Similarity'])
+        tree, group = self._get_group(None if baseline is None else str(baseline))
+        if tree is None:
+            return empty
+        excluded = np.zeros(len(group), dtype=bool)
+        if exclude is not None:
+            device, date, run = exclude
+            excluded = _match(group, 'Device', device) & _match(group, 'Date', date) & _match(group, 'Run', run)
+        k = min(k, len(group) - int(excluded.sum()))
+        if k <= 0:
+            return empty
+        queries = _unit_vectors(np.atleast_2d(np.asarray(vectors, dtype='float64')))
+        # ขอเผื่อจำนวนแถวของ run ที่ถูกตัดออก (ไม่กี่แถว) แล้วเก็บ k อันดับแรกที่เหลือ
+        k_query = k + int(excluded.sum())
+        distances, indices = tree.query(queries, k=k_query)
+        distances = distances.reshape(len(queries), k_query)
+        indices = indices.reshape(len(queries), k_query)
+        keep = np.argsort(excluded[indices], axis=1, kind='stable')[:, :k]
+        distances = np.take_along_axis(distances, keep, axis=1)
+        indices = np.take_along_axis(indices, keep, axis=1)
+        matches = group.iloc[indices.ravel()][META_COLUMNS].reset_index(drop=True)
+        matches.insert(0, 'Rank', np.tile(np.arange(1, k + 1), len(queries)))
+        matches.insert(0, 'Query', np.repeat(np.arange(len(queries)), k))
+        # ระยะ Euclidean ระหว่าง unit vector: d^2 = 2 - 2cos
+        matches['Cosine_Similarity'] = (1 - distances.ravel() ** 2 / 2).round(4)
+        return matches
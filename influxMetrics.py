@@ -0,0 +1,188 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+import numpy as np
+from influxdb import InfluxDBClient
+
+# query ที่ช้ากว่านี้ (ms) จะถูกเขียนลง slow-query log
+SLOW_QUERY_MS = float(os.getenv("INFLUXDB_SLOW_QUERY_MS") or 1000)
+SLOW_QUERY_LOG = os.getenv("INFLUXDB_SLOW_QUERY_LOG") or "slow_queries.log"
+METRICS_FILE = os.getenv("INFLUXDB_METRICS_FILE") or "influx_metrics.prom"
+# จำนวน query ล่าสุดที่ใช้คำนวณ percentile
+ROLLING_WINDOW = 1000
+# เขียน metrics file ไม่ถี่กว่านี้ (วินาที)
+METRICS_FILE_INTERVAL = 10
+
+def query_kind(query):
+    """ชื่อกลุ่มของ query เช่น SELECT, SHOW TAG VALUES, SHOW MEASUREMENTS"""
+    words = re.sub(r'\s+', ' ', query).strip().upper().split(' ')
+    if words[0] == 'SHOW':
+        return ' '.join(words[:3]) if len(words) > 2 and words[1] == 'TAG' else ' '.join(words[:2])
+    return words[0]
+
+class QueryMetrics:
+    """ตัวนับ latency / rows / bytes / errors ของทุก query (ใช้ร่วมกันทั้ง process)"""
+    def __init__(self, slow_query_ms=SLOW_QUERY_MS, slow_query_log=SLOW_QUERY_LOG, metrics_file=METRICS_FILE):
+        self.slow_query_ms = slow_query_ms
+        self.slow_query_log = slow_query_log
+        self.metrics_file = metrics_file
+        self.stats = {}
+        self.latencies = {}
+        self.operators = {}
+        self._last_write = 0
+        self._lock = threading.Lock()
+        self._context = threading.local()
+
+    def set_operator(self, operator):
+        """ผูก operator (เช่น session id) กับ thread ปัจจุบัน เพื่อแยกสถิติราย operator"""
+        self._context.operator = operator
+
+    def record(self, query, latency_ms, rows, response_bytes, error=None, bind_params=None):
+        kind = query_kind(query)
+        operator = getattr(self._context, 'operator', None) or '-'
+        with self._lock:
+            stat = self.stats.setdefault(kind, {'count': 0, 'errors': 0, 'latency_ms': 0.0, 'rows': 0, 'bytes': 0, 'slow': 0})
+            stat['count'] += 1
+            stat['errors'] += 1 if error else 0
+            stat['latency_ms'] += latency_ms
+            stat['rows'] += rows
+            stat['bytes'] += response_bytes
+            self.latencies.setdefault(kind, deque(maxlen=ROLLING_WINDOW)).append(latency_ms)
+            op = self.operators.setdefault(operator, {'count': 0, 'latency_ms': 0.0, 'rows': 0, 'bytes': 0})
+            op['count'] += 1
+            op['latency_ms'] += latency_ms
+            op['rows'] += rows
+            op['bytes'] += response_bytes
+            is_slow = latency_ms >= self.slow_query_ms
+            if is_slow:
+                stat['slow'] += 1
+        if is_slow or error:
+            self._log_slow(query, kind, operator, latency_ms, rows, response_bytes, error, bind_params)
+        self._maybe_write_metrics_file()
+
+    def _log_slow(self, query, kind, operator, latency_ms, rows, response_bytes, error, bind_params):
+        if not self.slow_query_log:
+            return
+        entry = {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'kind': kind,
+            'operator': operator,
+            'latency_ms': round(latency_ms, 1),
+            'rows': rows,
+            'bytes': response_bytes,
+            'error': str(error) if error else None,
+            'query': re.sub(r'\s+', ' ', query).strip(),
+            'bind_params': bind_params,
+        }
+        try:
+            with self._lock, open(self.slow_query_log, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+        except OSError as e:
+            print(f"[ERROR] Failed to write slow-query log: {e}")
+
+    def percentiles(self, kind, q=(50, 95, 99)):
+        with self._lock:
+            values = list(self.latencies.get(kind, ()))
+        if not values:
+            return {p: 0.0 for p in q}
+        return dict(zip(q, (float(v) for v in np.percentile(values, q))))
+
+    def summary(self):
+        """ตารางสรุปต่อประเภท query (list ของ dict)"""
+        with self._lock:
+            stats = {k: dict(v) for k, v in self.stats.items()}
+        rows = []
+        for kind, stat in sorted(stats.items()):
+            p = self.percentiles(kind)
+            rows.append({
+                'Query': kind,
+                'Count': stat['count'],
+                'Errors': stat['errors'],
+                'Slow': stat['slow'],
+                'Rows': stat['rows'],
+                'Bytes': stat['bytes'],
+                'Avg_ms': round(stat['latency_ms'] / stat['count'], 1) if stat['count'] else 0,
+                'p50_ms': round(p[50], 1),
+                'p95_ms': round(p[95], 1),
+                'p99_ms': round(p[99], 1),
+            })
+        return rows
+
+    def operator_summary(self):
+        with self._lock:
+            return [{'Operator': k, 'Count': v['count'], 'Latency_ms': round(v['latency_ms'], 1), 'Rows': v['rows'], 'Bytes': v['bytes']}
+                    for k, v in sorted(self.operators.items(), key=lambda item: -item[1]['latency_ms'])]
+
+    def to_prometheus(self):
+        """metrics ในรูปแบบ Prometheus text exposition"""
+        lines = []
+        counters = [
+            ('influxdb_queries_total', 'count', 'Number of InfluxDB queries'),
+            ('influxdb_query_errors_total', 'errors', 'Number of failed InfluxDB queries'),
+            ('influxdb_slow_queries_total', 'slow', 'Number of queries slower than the slow-query threshold'),
+            ('influxdb_query_rows_total', 'rows', 'Rows returned by InfluxDB queries'),
+            ('influxdb_query_response_bytes_total', 'bytes', 'Response bytes received from InfluxDB'),
+        ]
+        with self._lock:
+            stats = {k: dict(v) for k, v in self.stats.items()}
+        for name, field, help_text in counters:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for kind, stat in sorted(stats.items()):
+                lines.append(f'{name}{{query="{kind}"}} {stat[field]}')
+        lines.append('# HELP influxdb_query_latency_ms Rolling query latency percentiles in milliseconds')
+        lines.append('# TYPE influxdb_query_latency_ms summary')
+        for kind, stat in sorted(stats.items()):
+            for q, value in self.percentiles(kind, (50, 95, 99)).items():
+                lines.append(f'influxdb_query_latency_ms{{query="{kind}",quantile="{q / 100}"}} {value:.3f}')
+            lines.append(f'influxdb_query_latency_ms_sum{{query="{kind}"}} {stat["latency_ms"]:.3f}')
+            lines.append(f'influxdb_query_latency_ms_count{{query="{kind}"}} {stat["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def _maybe_write_metrics_file(self):
+        with self._lock:
+            if not self.metrics_file or time.time() - self._last_write < METRICS_FILE_INTERVAL:
+                return
+            self._last_write = time.time()
+        try:
+            # ไฟล์ชั่วคราวแยกต่อ thread เผื่อการเขียนครั้งก่อนยังไม่เสร็จ
+            tmp_path = f"{self.metrics_file}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(self.to_prometheus())
+            os.replace(tmp_path, self.metrics_file)
+        except OSError as e:
+            print(f"[ERROR] Failed to write metrics file: {e}")
+
+# ตัวนับกลางของทั้ง process
+metrics = QueryMetrics()
+
+class InstrumentedInfluxDBClient(InfluxDBClient):
+    """InfluxDBClient ที่บันทึก latency, rows, response bytes และ query text ของทุก query ลง metrics"""
+    def __init__(self, *args, metrics=metrics, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = metrics
+        self._response = threading.local()
+
+    def request(self, *args, **kwargs):
+        response = super().request(*args, **kwargs)
+        self._response.bytes = len(response.content or b'')
+        return response
+
+    def query(self, query, *args, **kwargs):
+        self._response.bytes = 0
+        start = time.perf_counter()
+        try:
+            result = super().query(query, *args, **kwargs)
+        except Exception as e:
+            latency_ms = (time.perf_counter() - start) * 1000
+            self.metrics.record(query, latency_ms, 0, getattr(self._response, 'bytes', 0), error=e, bind_params=kwargs.get('bind_params'))
+            raise
+        latency_ms = (time.perf_counter() - start) * 1000
+        results = result if isinstance(result, list) else [result]
+        rows = sum(len(serie.get('values', [])) for r in results for serie in r.raw.get('series', []))
+        self.metrics.record(query, latency_ms, rows, getattr(self._response, 'bytes', 0), bind_params=kwargs.get('bind_params'))
+        return result
@@ -0,0 +1,71 @@
+import os
+from datetime import datetime
+import pandas as pd
+import pytz
+from singleFlight import CoalescingInfluxDBClient
+
+def client_settings():
+    """ค่าการเชื่อมต่อ InfluxDB จาก environment (เรียกหลัง load_dotenv)"""
+    port_str = os.getenv("INFLUXDB_PORT")
+    return {
+        'host': os.getenv("INFLUXDB_HOST") or "localhost",
+        'port': int(port_str) if port_str is not None else 8086,  # Default to 8086 if not set
+        'username': os.getenv("INFLUXDB_USER") or "",
+        'password': os.getenv("INFLUXDB_PASS") or "",
+        'database': os.getenv("INFLUXDB_DB") or "",
+        # ขนาด connection pool ของ client ที่ใช้ร่วมกันทุก session (Streamlit รันแต่ละ session คนละ thread)
+        'pool_size': int(os.getenv("INFLUXDB_POOL_SIZE") or 32),
+    }
+
+def create_client():
+    """client ที่ query เหมือนกันและเกิดพร้อมกันจะถูกรวมเป็นครั้งเดียว (raise ถ้าเชื่อมต่อไม่ได้)"""
+    client = CoalescingInfluxDBClient(**client_settings())
+    client.get_list_database()
+    return client
+
+def to_rfc3339(unix_ms):
+    return datetime.fromtimestamp(unix_ms / 1000, tz=pytz.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+def build_query(measurement, serial_no, start_unix, end_unix, use_station=False):
+    # ถ้า use_station=True จะใช้ sName แทน sn ในการ query
+    # ใช้ equality predicate + bind parameters แทน regex เพื่อให้ InfluxDB ใช้ tag index ได้
+    tag_key = "sName" if use_station else "sn"
+    query = f'''
+    SELECT mean("a1") AS "s1", mean("a2") AS "s2", mean("a3") AS "s3", mean("a4") AS "s4",
+           mean("a5") AS "s5", mean("a6") AS "s6", mean("a7") AS "s7", mean("a8") AS "s8"
+    FROM "{measurement}"
+    WHERE "{tag_key}" = $tag_value
+      AND time >= $start AND time <= $end
+    GROUP BY time(1m) fill(none)
+    '''
+    bind_params = {"tag_value": serial_no, "start": to_rfc3339(start_unix * 1000), "end": to_rfc3339(end_unix * 1000)}
+    return query, bind_params
+
+def result_to_dataframe(result):
+    # get_points อาจ error ถ้าไม่มี series
+    points = []
+    for serie in result.raw.get('series', []):
+        for v in serie.get('values', []):
+            # Map columns to values
+            row = dict(zip(serie['columns'], v))
+            points.append(row)
+    if not points:
+        return pd.DataFrame(columns=["Time", "s1", "s2", "s3", "s4", "s5", "s6", "s7", "s8", "Smell"])
+    df = pd.DataFrame(points)
+    # Rename time column
+    df.rename(columns={"time": "Time"}, inplace=True)
+    # Convert time - InfluxDB returns UTC time, convert to Bangkok timezone properly
+    utc_time = pd.to_datetime(df["Time"], utc=True)
+    df.index = (utc_time - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(seconds=1)
+    df["Time"] = utc_time.dt.tz_convert('Asia/Bangkok').dt.strftime('%d/%m/%Y  %H:%M:%S')
+    # Only keep s1-s8
+    for col in ["s1","s2","s3","s4","s5","s6","s7","s8"]:
+        if col in df.columns:
+            df[col] = df[col].round().astype('Int64').astype(str).replace('<NA>', '')
+        else:
+            df[col] = ''
+    # Add Smell column
+    df["Smell"] = ""
+    # Reorder columns
+    df = df[["Time", "s1", "s2", "s3", "s4", "s5", "s6", "s7", "s8", "Smell"]]
+    return df
@@ -0,0 +1,191 @@
+import os
+import numpy as np
+import pandas as pd
+from processDataset import SENSOR_COLUMNS
+
+# จำนวนแถวที่อ่านต่อ chunk (memory ใช้ตามขนาด chunk ไม่ใช่ขนาดไฟล์)
+DEFAULT_CHUNKSIZE = 500_000
+
+OUTPUT_COLUMNS = ["Time"] + SENSOR_COLUMNS + ["Smell"]
+
+# รูปแบบเวลาที่ลองตามลำดับ (ตรวจครั้งเดียวต่อไฟล์) รวมรูปแบบของแอปเอง (smell_label.csv มีช่องว่าง 2 ช่อง)
+TIME_FORMATS = ['ISO8601', '%d/%m/%Y  %H:%M:%S', '%d/%m/%Y %H:%M:%S']
+# จำนวนค่าแรกของไฟล์ที่ใช้ตรวจรูปแบบเวลา
+TIME_FORMAT_SAMPLE = 1000
+
+def detect_format(source):
+    name = source if isinstance(source, str) else getattr(source, 'name', '')
+    return 'parquet' if os.path.splitext(str(name))[1].lower() in ('.parquet', '.pq') else 'csv'
+
+def detect_time_format(raw_time):
+    """
+    คืนรูปแบบแรกใน TIME_FORMATS ที่อ่านค่าตัวอย่างได้ทั้งหมด หรือ None ถ้าไม่ตรงรูปแบบใดเลย
+
+    >>> detect_time_format(pd.Series(['2026-01-02 08:00:00', '2026-01-13 08:00:00']))
+    'ISO8601'
+    >>> detect_time_format(pd.Series(['02/01/2026  08:00:00']))
+    '%d/%m/%Y  %H:%M:%S'
+    """
+    sample = raw_time.dropna().astype(str).str.strip().head(TIME_FORMAT_SAMPLE)
+    if sample.empty:
+        return None
+    for time_format in TIME_FORMATS:
+        try:
+            pd.to_datetime(sample, format=time_format)
+            return time_format
+        except (ValueError, TypeError):
+            continue
+    return None
+
+def _to_unix(parsed, tz):
+    if parsed.dt.tz is None:
+        parsed = parsed.dt.tz_localize(tz, ambiguous='NaT', nonexistent='NaT')
+    return ((parsed - pd.Timestamp(0, tz='UTC')) / pd.Timedelta(seconds=1)).to_numpy(dtype='float64')
+
+def parse_log_times(raw_time, tz='Asia/Bangkok', time_format=None):
+    """
+    แปลงคอลัมน์เวลา (ข้อความ) เป็น unix (วินาที) แบบ vectorized ด้วยรูปแบบเดียวทั้ง chunk
+    time_format=None (ไม่รู้รูปแบบ): ค่าที่ขึ้นต้นแบบ ISO (yyyy-mm-dd) อ่านแบบ ISO ส่วนค่าอื่นอ่านแบบวันขึ้นก่อน (dd/mm)
+    ค่าเวลาที่ไม่มี timezone ถือเป็นเวลาใน tz
+
+    >>> parse_log_times(pd.Series(['2026-01-02 08:00:00']), 'UTC', 'ISO8601').tolist()
+    [1767340800.0]
+    >>> parse_log_times(pd.Series(['2026-01-02 08:00:00', '02/01/2026 08:00:00']), 'UTC').tolist()
+    [1767340800.0, 1767340800.0]
+    """
+    if pd.api.types.is_datetime64_any_dtype(raw_time):
+        return _to_unix(raw_time, tz)
+    text = raw_time.astype(str).str.strip()
+    if time_format is not None:
+        return _to_unix(pd.to_datetime(text, format=time_format, errors='coerce'), tz)
+    is_iso = text.str.match(r'\d{4}-\d{2}-\d{2}').to_numpy()
+    unix = np.full(len(text), np.nan)
+    if is_iso.any():
+        unix[is_iso] = _to_unix(pd.to_datetime(text[is_iso], format='ISO8601', errors='coerce'), tz)
+    if not is_iso.all():
+        unix[~is_iso] = _to_unix(pd.to_datetime(text[~is_iso], format='mixed', dayfirst=True, errors='coerce'), tz)
+    return unix
+
+def _rename_log_columns(chunk):
+    columns = {}
+    for col in chunk.columns:
+        key = str(col).strip().lower()
+        if key in ('time', 'timestamp', 'datetime'):
+            columns[col] = 'time'
+        elif len(key) == 2 and key[0] in ('a', 's') and key[1] in '12345678':
+            columns[col] = 's' + key[1]
+    return chunk.rename(columns=columns)
+
+def normalize_log_chunk(chunk, tz='Asia/Bangkok', time_format=None):
+    """
+    แปลง chunk ของ log ให้เหลือคอลัมน์ unix (วินาที) และ s1-s8 (ตัวเลข)
+    รองรับคอลัมน์เวลา time/timestamp/Time และ sensor ชื่อ a1-a8 หรือ s1-s8
+    time_format: รูปแบบเวลาจาก detect_time_format (None = ตรวจจาก chunk นี้)
+    """
+    chunk = _rename_log_columns(chunk)
+    if 'time' not in chunk.columns:
+        raise ValueError("ไม่พบคอลัมน์เวลา (time / timestamp) ในไฟล์ Log")
+
+    raw_time = chunk['time']
+    if pd.api.types.is_numeric_dtype(raw_time):
+        unix = raw_time.to_numpy(dtype='float64')
+        # ค่า epoch ที่ใหญ่กว่า 1e11 ถือว่าเป็น ms
+        unix = np.where(unix > 1e11, unix / 1000, unix)
+    else:
+        if time_format is None and not pd.api.types.is_datetime64_any_dtype(raw_time):
+            time_format = detect_time_format(raw_time)
+        unix = parse_log_times(raw_time, tz, time_format)
+
+    out = pd.DataFrame({'unix': unix}, index=chunk.index)
+    for col in SENSOR_COLUMNS:
+        out[col] = pd.to_numeric(chunk[col], errors='coerce') if col in chunk.columns else np.nan
+    return out[np.isfinite(out['unix'].to_numpy())]
+
+def read_sensor_log_chunks(source, file_format=None, chunksize=DEFAULT_CHUNKSIZE, tz='Asia/Bangkok'):
+    """
+    อ่านไฟล์ Log ทีละ chunk (path บน server จะถูก memory-map)
+    source: path หรือ file-like (เช่นไฟล์จาก st.file_uploader)
+    รูปแบบเวลาถูกตรวจจาก chunk แรกครั้งเดียวแล้วใช้กับทั้งไฟล์
+    """
+    file_format = file_format or detect_format(source)
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    if file_format == 'parquet':
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("ต้องติดตั้ง pyarrow เพื่ออ่านไฟล์ Parquet")
+        parquet_file = pq.ParquetFile(source, memory_map=isinstance(source, str))
+        chunks = (batch.to_pandas() for batch in parquet_file.iter_batches(batch_size=chunksize))
+    else:
+        chunks = pd.read_csv(source, chunksize=chunksize, memory_map=isinstance(source, str))
+    time_format = None
+    for chunk in chunks:
+        chunk = _rename_log_columns(chunk)
+        raw_time = chunk.get('time')
+        if (time_format is None and raw_time is not None and not pd.api.types.is_numeric_dtype(raw_time)
+                and not pd.api.types.is_datetime64_any_dtype(raw_time)):
+            time_format = detect_time_format(raw_time)
+        yield normalize_log_chunk(chunk, tz, time_format)
+
+class SplitLabeler:
+    """
+    ติด label ให้แถวตามช่วงเวลาของแต่ละ split แบบ vectorized แล้วสะสม sum/count ต่อ bucket
+    ผลลัพธ์เท่ากับ GROUP BY time(bucket) ของ InfluxDB โดย memory ขึ้นกับจำนวน bucket ไม่ใช่จำนวนแถว
+    """
+    def __init__(self, split_ranges, bucket=60):
+        self.split_ranges = list(split_ranges)
+        self.bucket = bucket
+        self.sums = [None] * len(self.split_ranges)
+        self.counts = [None] * len(self.split_ranges)
+        self.first_start = min((s for s, _ in self.split_ranges), default=0)
+        self.last_end = max((e for _, e in self.split_ranges), default=0)
+
+    def update(self, chunk):
+        if chunk.empty:
+            return
+        t = chunk['unix'].to_numpy()
+        buckets = (t // self.bucket).astype('int64') * self.bucket
+        if buckets.max() < (self.first_start // self.bucket) * self.bucket or buckets.min() >= self.last_end:
+            return
+        values = chunk[SENSOR_COLUMNS]
+        for i, (start, end) in enumerate(self.split_ranges):
+            # กติกาเดียวกับ fetch_split_dataframes: bucket ที่เริ่มในช่วง [bucket ของ start, end)
+            mask = (buckets >= (start // self.bucket) * self.bucket) & (buckets < end)
+            if not mask.any():
+                continue
+            grouped = values[mask].groupby(buckets[mask])
+            sums, counts = grouped.sum(), grouped.count()
+            if self.sums[i] is None:
+                self.sums[i], self.counts[i] = sums, counts
+            else:
+                self.sums[i] = self.sums[i].add(sums, fill_value=0)
+                self.counts[i] = self.counts[i].add(counts, fill_value=0)
+
+    def split_dataframes(self, tz='Asia/Bangkok'):
+        """คืน DataFrame ต่อ split ในรูปแบบเดียวกับ query_to_dataframe ใน main.py"""
+        frames = []
+        for sums, counts in zip(self.sums, self.counts):
+            if sums is None:
+                frames.append(pd.DataFrame(columns=OUTPUT_COLUMNS))
+                continue
+            means = (sums / counts.where(counts > 0)).sort_index()
+            # fill(none): ตัด bucket ที่ไม่มีค่า sensor เลย
+            means = means[means.notna().any(axis=1)]
+            df = pd.DataFrame(index=means.index)
+            df["Time"] = pd.to_datetime(means.index, unit='s', utc=True).tz_convert(tz).strftime('%d/%m/%Y  %H:%M:%S')
+            for col in SENSOR_COLUMNS:
+                df[col] = means[col].round().astype('Int64').astype(str).replace('<NA>', '')
+            df["Smell"] = ""
+            frames.append(df[OUTPUT_COLUMNS].reset_index(drop=True))
+        return frames
+
+def fetch_log_split_dataframes(source, split_ranges, bucket=60, file_format=None, chunksize=DEFAULT_CHUNKSIZE, tz='Asia/Bangkok'):
+    """
+    อ่านไฟล์ Log รอบเดียวแล้วคืน DataFrame ต่อ split (เรียงตาม split_ranges)
+    ใช้แทน fetch_split_dataframes เมื่อข้อมูลไม่ได้อยู่ใน InfluxDB
+    """
+    labeler = SplitLabeler(split_ranges, bucket)
+    for chunk in read_sensor_log_chunks(source, file_format, chunksize, tz):
+        labeler.update(chunk)
+    return labeler.split_dataframes(tz)
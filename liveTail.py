@@ -0,0 +1,61 @@
+import time
+from collections import deque
+import pandas as pd
+from processDataset import SENSOR_COLUMNS, SmellAggregator
+
+# จำนวน bucket (นาที) ที่เก็บไว้ใน ring buffer
+DEFAULT_BUFFER_SIZE = 1440
+# ช่วงย้อนหลังที่ดึงในการ poll ครั้งแรก (วินาที)
+DEFAULT_BACKFILL = 3600
+
+class LiveTail:
+    """
+    สถานะ Live mode ของอุปกรณ์หนึ่งตัว
+    - cursor: เวลาเริ่มของ bucket ล่าสุดที่เห็น (bucket ล่าสุดอาจยังไม่ครบนาที จึง query ตั้งแต่ cursor ซ้ำ 1 bucket)
+    - buffer: ring buffer ของแถวล่าสุด (unix, row)
+    - aggregator: running fingerprint ที่ป้อนเฉพาะ bucket ที่ครบแล้ว bucket ละครั้งเดียว
+    """
+    def __init__(self, start_unix=None, bucket=60, maxlen=DEFAULT_BUFFER_SIZE):
+        if start_unix is None:
+            start_unix = int(time.time()) - DEFAULT_BACKFILL
+        self.bucket = bucket
+        self.cursor = (start_unix // bucket) * bucket
+        self.committed = self.cursor - bucket
+        self.buffer = deque(maxlen=maxlen)
+        self.aggregator = SmellAggregator()
+        self.last_poll = None
+        self.last_fetched = 0
+
+    def poll(self, fetch, smell_label="Live"):
+        """
+        fetch(cursor): คืน DataFrame ของแถวที่ time >= cursor โดย index เป็น unix timestamp (วินาที)
+        return: จำนวนแถวที่ดึงได้ใน poll นี้
+        """
+        df = fetch(self.cursor)
+        self.last_poll = time.time()
+        self.last_fetched = len(df)
+        if df.empty:
+            return 0
+        df = df.sort_index()
+        for unix, row in zip(df.index, df.to_dict('records')):
+            if self.buffer and self.buffer[-1][0] == unix:
+                self.buffer[-1] = (unix, row)
+            elif not self.buffer or unix > self.buffer[-1][0]:
+                self.buffer.append((unix, row))
+
+        newest = df.index.max()
+        complete = df[(df.index > self.committed) & (df.index < newest)]
+        if not complete.empty:
+            self.aggregator.update(complete, smell=smell_label)
+            self.committed = complete.index.max()
+        self.cursor = newest
+        return len(df)
+
+    def to_frame(self):
+        """แถวใน ring buffer เป็น DataFrame (index = unix timestamp, s1-s8 เป็นตัวเลข)"""
+        if not self.buffer:
+            return pd.DataFrame(columns=["Time"] + SENSOR_COLUMNS)
+        index, rows = zip(*self.buffer)
+        df = pd.DataFrame(list(rows), index=list(index))
+        df[SENSOR_COLUMNS] = df[SENSOR_COLUMNS].apply(pd.to_numeric, errors='coerce')
+        return df
@@ -1,12 +1,20 @@
 # 1. Import
-from influxdb import InfluxDBClient
+from influxMetrics import metrics as influx_metrics
+from singleFlight import single_flight, query_key
+from influxQueries import to_rfc3339, build_query, result_to_dataframe
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import streamlit as st
-from collections import Counter
 from datetime import datetime, time, timedelta
 import pandas as pd
 import io
 import numpy as np
 import processDataset
+import tagIndex
+import ingestLogs
+import fingerprintLibrary
+import liveTail
+import warmup
+import influxQueries
 import zipfile
 from dotenv import load_dotenv
 import os
@@ -15,36 +23,23 @@ import pytz
 # Load environment variables from .env file
 load_dotenv()
 
-# InfluxDB connection settings
-host = os.getenv("INFLUXDB_HOST") or "localhost"
-port_str = os.getenv("INFLUXDB_PORT")
-port = int(port_str) if port_str is not None else 8086  # Default to 8086 if not set
-username = os.getenv("INFLUXDB_USER") or ""
-password = os.getenv("INFLUXDB_PASS") or ""
-database = os.getenv("INFLUXDB_DB") or ""
-
-# Create InfluxDB client
-client = InfluxDBClient(
-    host=host,
-    port=port,
-    username=username,
-    password=password,
-    database=database
-)
+# ค่าการเชื่อมต่อ InfluxDB (INFLUXDB_HOST / PORT / USER / PASS / DB / POOL_SIZE) อ่านใน influxQueries.client_settings
+
+# โฟลเดอร์บน server ที่อนุญาตให้อ่านไฟล์ Log ได้ (ไม่ตั้งค่า = อัปโหลดไฟล์ได้อย่างเดียว)
+sensor_log_dir = os.getenv("SENSOR_LOG_DIR") or ""
 
 #---------------------------------------------------------------------------------------
 
 # 2. Functions
+
+# client เดียวใช้ร่วมกันทั้ง process: query ที่เหมือนกันและเกิดพร้อมกันจะถูกรวมเป็นครั้งเดียว
+@st.cache_resource(show_spinner=False)
+def get_shared_client():
+    return influxQueries.create_client()
+
 def connect_influxdb_v1():
     try:
-        client = InfluxDBClient(
-            host=os.getenv("INFLUXDB_HOST") or "",
-            port=int(os.getenv("INFLUXDB_PORT") or 8086),
-            username=os.getenv("INFLUXDB_USER") or "",
-            password=os.getenv("INFLUXDB_PASS") or "",
-            database=os.getenv("INFLUXDB_DB") or ""
-        )
-        client.get_list_database()
+        client = get_shared_client()
         print("[DEBUG] Connected to InfluxDB successfully.")
         return client
     except Exception as e:
@@ -52,9 +47,14 @@ def connect_influxdb_v1():
         return None
 
 def get_measurements(client):
+    # ใช้รายการที่ warm-up โหลดไว้ก่อน ถ้ายังไม่หมดอายุ
+    cached = warmup.prefetch_cache.get_measurements()
+    if cached is not None:
+        return cached
     try:
         result = client.query("SHOW MEASUREMENTS")
         measurements = [m['name'] for m in result.get_points()]
+        warmup.prefetch_cache.set_measurements(measurements)
         return measurements
     except Exception as e:
         print(f"[ERROR] Failed to query measurements: {e}")
@@ -64,10 +64,7 @@ def get_measurements(client):
 def get_serial_numbers(client, measurement):
     try:
         # ใช้ SHOW TAG VALUES แบบเดียวกับ Grafana เพื่อดึง serial number ทั้งหมด
-        query = f'SHOW TAG VALUES FROM "{measurement}" WITH KEY = "sn"'
-        result = client.query(query)
-        serials = [point['value'] for point in result.get_points()]
-        return serials
+        return tagIndex.query_tag_values(client, measurement, "sn")
     except Exception as e:
         print(f"[ERROR] Failed to query serial numbers: {e}")
         return []
@@ -75,10 +72,7 @@ def get_serial_numbers(client, measurement):
 # ฟังก์ชันดึง Station Names (sName) จาก measurement
 def get_station_names(client, measurement):
     try:
-        query = f'SHOW TAG VALUES FROM "{measurement}" WITH KEY = "sName"'
-        result = client.query(query)
-        stations = [point['value'] for point in result.get_points()]
-        return stations
+        return tagIndex.query_tag_values(client, measurement, "sName")
     except Exception as e:
         print(f"[ERROR] Failed to query station names: {e}")
         return []
@@ -87,6 +81,13 @@ def get_station_names(client, measurement):
 
 # 3. UI
 
+# ผูก session ของ operator กับ query metrics
+def bind_operator():
+    run_ctx = get_script_run_ctx()
+    influx_metrics.set_operator(run_ctx.session_id[:8] if run_ctx else None)
+
+bind_operator()
+
 
 client = connect_influxdb_v1()
 if client:
@@ -156,24 +157,57 @@ def serial_sort_key(sn):
         pass
     return (0, 0, sn)
 
+# จำนวนตัวเลือกต่อหน้าใน dropdown Serial No. / Station
+TAG_PAGE_SIZE = 50
+
+# index ของค่า tag ใช้ร่วมกันทุก session (สร้างครั้งเดียว แล้ว refresh เฉพาะค่าใหม่)
+def get_tag_index(measurement, key):
+    return tagIndex.get_index(measurement, key)
+
+def load_tag_index(client, measurement, key):
+    index = get_tag_index(measurement, key)
+    try:
+        index.ensure(client)
+    except Exception as e:
+        print(f"[ERROR] Failed to query tag values ({key}): {e}")
+    return index
+
+def tag_search_options(index, label, key, sort_key=None):
+    """ช่องค้นหา + แบ่งหน้า คืนเฉพาะค่าที่ตรงกับคำค้นในหน้าที่เลือก"""
+    search_text = st.text_input(f"🔎 ค้นหา {label} (พิมพ์บางส่วน) :", key=f"{key}_search")
+    matches, total = index.search(search_text, limit=TAG_PAGE_SIZE, sort_key=sort_key)
+    if total > TAG_PAGE_SIZE:
+        num_pages = (total + TAG_PAGE_SIZE - 1) // TAG_PAGE_SIZE
+        page = st.number_input(f"หน้า (ทั้งหมด {num_pages} หน้า, {total} รายการ)", min_value=1, max_value=num_pages, value=1, step=1, key=f"{key}_page")
+        matches, total = index.search(search_text, limit=TAG_PAGE_SIZE, offset=(page - 1) * TAG_PAGE_SIZE, sort_key=sort_key)
+    elif not matches and search_text and client:
+        # index ยังไม่มีค่านี้ ให้ server ค้นเฉพาะค่าที่ตรงกับคำค้น
+        try:
+            matches = tagIndex.query_tag_values(client, index.measurement, index.key, pattern=search_text.strip(), limit=TAG_PAGE_SIZE)
+            index.add(matches)
+            matches = sorted(matches, key=sort_key)
+        except Exception as e:
+            print(f"[ERROR] Failed to search tag values ({index.key}): {e}")
+    return matches
+
+sn_index = None
 if not measurements:
     measurements = ["-"]
     selected_measurement = st.selectbox("กรุณาเลือก Measurement :", measurements, index=0)
-    serial_numbers = []
     unique_serial_numbers = ["-"]
     selected_sn = st.selectbox("กรุณาเลือก Serial No. :", unique_serial_numbers, disabled=True)
     selected_station = None
 else:
     measurements = ["-"] + measurements
     selected_measurement = st.selectbox("กรุณาเลือก Measurement :", measurements, index=0)
-    serial_numbers = []
+    serial_matches = []
     if client and selected_measurement != "-":
-        serial_numbers = get_serial_numbers(client, selected_measurement)
+        sn_index = load_tag_index(client, selected_measurement, "sn")
+        serial_matches = tag_search_options(sn_index, "Serial No.", "sn", sort_key=serial_sort_key)
     
     # เพิ่มตัวเลือก "ไม่เจอ" ลงใน dropdown
-    unique_serial_numbers = sorted(set(serial_numbers), key=serial_sort_key) if serial_numbers else []
-    if unique_serial_numbers:
-        unique_serial_numbers = ["-"] + unique_serial_numbers + ["❌ ไม่เจอ - ค้นหาจาก Station"]
+    if serial_matches:
+        unique_serial_numbers = ["-"] + serial_matches + ["❌ ไม่เจอ - ค้นหาจาก Station"]
     else:
         unique_serial_numbers = ["-", "❌ ไม่เจอ - ค้นหาจาก Station"]
     
@@ -183,10 +217,9 @@ else:
     selected_station = None
     if selected_sn == "❌ ไม่เจอ - ค้นหาจาก Station":
         if client and selected_measurement != "-":
-            station_names = get_station_names(client, selected_measurement)
-            unique_stations = sorted(set(station_names)) if station_names else ["-"]
-            if unique_stations and unique_stations != ["-"]:
-                unique_stations = ["-"] + unique_stations
+            station_index = load_tag_index(client, selected_measurement, "sName")
+            station_matches = tag_search_options(station_index, "Station", "sName")
+            unique_stations = ["-"] + station_matches
             selected_station = st.selectbox("🔍 กรุณาเลือก Station (sName) :", unique_stations)
             if selected_station != "-":
                 st.info(f"💡 ระบบจะใช้ Station: **{selected_station}** ในการ query ข้อมูล")
@@ -222,82 +255,178 @@ if 'num_fixed_points' not in st.session_state:
 def build_fixed_point_query(measurement, serial_no, fix_unix, use_station=False, is_second=False):
     tag_key = "sName" if use_station else "sn"
     if is_second:
-        start_ms = f"{fix_unix}000ms"
-        end_ms = f"{fix_unix}999ms"
+        start_ms = fix_unix * 1000
+        end_ms = fix_unix * 1000 + 999
         group_by = "time(1s)"
     else:
         fix_min = (fix_unix // 60) * 60
-        start_ms = f"{fix_min}000ms"
-        end_ms = f"{fix_min + 59}999ms"
+        start_ms = fix_min * 1000
+        end_ms = (fix_min + 59) * 1000 + 999
         group_by = "time(1m)"
     query = f'''
     SELECT mean("a1") AS "s1", mean("a2") AS "s2", mean("a3") AS "s3", mean("a4") AS "s4",
            mean("a5") AS "s5", mean("a6") AS "s6", mean("a7") AS "s7", mean("a8") AS "s8"
     FROM "{measurement}"
-    WHERE ("{tag_key}" =~ /^({serial_no})$/)
-      AND time >= {start_ms} AND time <= {end_ms}
+    WHERE "{tag_key}" = $tag_value
+      AND time >= $start AND time <= $end
     GROUP BY {group_by} fill(none)
     '''
-    return query
+    bind_params = {"tag_value": serial_no, "start": to_rfc3339(start_ms), "end": to_rfc3339(end_ms)}
+    return query, bind_params
 
-def build_query(measurement, serial_no, start_unix, end_unix, use_station=False):
-    # InfluxDB ใช้ ms
-    # ถ้า use_station=True จะใช้ sName แทน sn ในการ query
+def build_live_query(measurement, serial_no, cursor_unix, use_station=False):
+    # Live mode: ดึงเฉพาะข้อมูลตั้งแต่ cursor (bucket ล่าสุดที่เห็น) จนถึงปัจจุบัน
     tag_key = "sName" if use_station else "sn"
     query = f'''
     SELECT mean("a1") AS "s1", mean("a2") AS "s2", mean("a3") AS "s3", mean("a4") AS "s4",
            mean("a5") AS "s5", mean("a6") AS "s6", mean("a7") AS "s7", mean("a8") AS "s8"
     FROM "{measurement}"
-    WHERE ("{tag_key}" =~ /^({serial_no})$/)
-      AND time >= {start_unix}000ms AND time <= {end_unix}000ms
+    WHERE "{tag_key}" = $tag_value
+      AND time >= $start
     GROUP BY time(1m) fill(none)
     '''
-    return query
+    bind_params = {"tag_value": serial_no, "start": to_rfc3339(cursor_unix * 1000)}
+    return query, bind_params
+
+def plan_split_ranges(split_ranges, bucket=60):
+    """
+    รวมช่วงเวลาของ splits ที่ซ้อนกันหรือติดกัน (ไม่มี bucket ว่างคั่น) ให้เหลือจำนวน query น้อยที่สุด
+    split_ranges: list ของ (start_unix, end_unix)
+    return: list ของ (start_unix, end_unix, [index ของ split ที่อยู่ในช่วงนี้])
+    """
+    order = sorted(range(len(split_ranges)), key=lambda i: split_ranges[i])
+    plan = []
+    for i in order:
+        start, end = split_ranges[i]
+        if plan and start // bucket <= plan[-1][1] // bucket + 1:
+            plan[-1][1] = max(plan[-1][1], end)
+            plan[-1][2].append(i)
+        else:
+            plan.append([start, end, [i]])
+    return [tuple(p) for p in plan]
+
+def fetch_split_dataframes(client, measurement, serial_no, split_ranges, use_station=False):
+    """
+    query แต่ละช่วงที่รวมแล้วเพียงครั้งเดียว แล้วตัดแถวกลับไปให้แต่ละ split ตาม bucket (1 นาที)
+    split ได้ bucket ที่เริ่มในช่วง [นาทีของ start, end) เสมอ ไม่ว่าจะถูกรวมกับ split อื่นหรือไม่
+    (split ที่จบตรงนาทีพอดี เช่น 10:05:00 จะไม่ได้ bucket 10:05 ซึ่งเป็นของ split ถัดไป)
+    return: list ของ DataFrame เรียงตาม split_ranges
+    """
+    frames = [None] * len(split_ranges)
+    for start, end, members in plan_split_ranges(split_ranges):
+        # ถ้าช่วงนี้ถูก prefetch ไว้แล้วใช้จาก memory และ query เฉพาะส่วนท้ายที่เกินเวลาที่ prefetch
+        cached = warmup.prefetch_cache.get(measurement, serial_no, use_station, start, end)
+        if cached is None:
+            query, bind_params = build_query(measurement, serial_no, start, end, use_station)
+            df = query_to_dataframe(client, query, bind_params)
+        else:
+            df, covered_end = cached
+            if covered_end < end:
+                query, bind_params = build_query(measurement, serial_no, covered_end + 1, end, use_station)
+                df = pd.concat([df, query_to_dataframe(client, query, bind_params)])
+        for i in members:
+            split_start, split_end = split_ranges[i]
+            mask = (df.index >= (split_start // 60) * 60) & (df.index < split_end)
+            frames[i] = df[mask].reset_index(drop=True)
+    return frames
+
+def resolve_log_path(path):
+    """คืน path จริงของไฟล์ Log ถ้าอยู่ภายใน sensor_log_dir ไม่เช่นนั้นคืน None"""
+    if not sensor_log_dir or not path:
+        return None
+    base = os.path.realpath(sensor_log_dir)
+    full = os.path.realpath(os.path.join(base, path))
+    if os.path.commonpath([base, full]) != base or not os.path.isfile(full):
+        return None
+    return full
 
-def query_to_dataframe(client, query):
+def read_log_split_dataframes(source, split_ranges, bucket=60):
+    """เหมือน ingestLogs.fetch_log_split_dataframes แต่แสดง error บนหน้าจอแทนการ raise"""
     try:
-        result = client.query(query)
-        # get_points อาจ error ถ้าไม่มี series
-        points = []
-        for serie in result.raw.get('series', []):
-            for v in serie.get('values', []):
-                # Map columns to values
-                row = dict(zip(serie['columns'], v))
-                points.append(row)
-        if not points:
-            return pd.DataFrame(columns=["Time", "s1", "s2", "s3", "s4", "s5", "s6", "s7", "s8", "Smell"])
-        df = pd.DataFrame(points)
-        # Rename time column
-        df.rename(columns={"time": "Time"}, inplace=True)
-        # Convert time - InfluxDB returns UTC time, convert to Bangkok timezone properly
-        df["Time"] = pd.to_datetime(df["Time"], utc=True).dt.tz_convert('Asia/Bangkok').dt.strftime('%d/%m/%Y  %H:%M:%S')
-        # Only keep s1-s8
-        for col in ["s1","s2","s3","s4","s5","s6","s7","s8"]:
-            if col in df.columns:
-                df[col] = df[col].round().astype('Int64').astype(str).replace('<NA>', '')
-            else:
-                df[col] = ''
-        # Add Smell column
-        df["Smell"] = ""
-        # Reorder columns
-        df = df[["Time", "s1", "s2", "s3", "s4", "s5", "s6", "s7", "s8", "Smell"]]
-        return df
+        return ingestLogs.fetch_log_split_dataframes(source, split_ranges, bucket)
+    except Exception as e:
+        st.error(f"[ERROR] Failed to read log file: {e}")
+        return [pd.DataFrame(columns=ingestLogs.OUTPUT_COLUMNS) for _ in split_ranges]
+
+def run_identity(combined_df):
+    """
+    (Device, Date, Run) ของ run สำหรับคลัง Fingerprint
+    Device: ชื่อไฟล์ Log ถ้านำเข้าจากไฟล์ ไม่เช่นนั้นเป็น Serial No. / Station ที่ export
+    Date: วันแรกในคอลัมน์ Time ของข้อมูล
+    Run: ช่วงเวลาของข้อมูลที่ export (เวลาแรก-เวลาสุดท้าย) แยก run หลายครั้งในวันเดียวกัน
+    """
+    source = st.session_state.get('log_source')
+    if source is not None:
+        device = os.path.basename(source if isinstance(source, str) else getattr(source, 'name', '') or '-')
+    else:
+        device = st.session_state.get('selected_sn') or "-"
+    times = pd.to_datetime(combined_df['Time'], format='%d/%m/%Y  %H:%M:%S', errors='coerce')
+    if times.isna().all():
+        return device, "-", "-"
+    return device, times.min().date().isoformat(), f"{times.min():%H:%M:%S}-{times.max():%H:%M:%S}"
+
+def query_to_dataframe(client, query, bind_params=None):
+    """คืน DataFrame ที่มี index เป็น unix timestamp (วินาที) ของแต่ละแถว"""
+    # session ที่ขอ query เดียวกันพร้อมกันจะใช้ผลลัพธ์ที่ decode แล้วชุดเดียวกัน (copy เพราะผู้เรียกแก้ไข df ต่อ)
+    # st.error อยู่นอกส่วนที่ใช้ร่วมกัน ทุก session ที่รอจึงเห็น error เอง
+    key = ('dataframe',) + query_key(query, bind_params=bind_params)
+    try:
+        df = single_flight.do(key, lambda: result_to_dataframe(client.query(query, bind_params=bind_params)))
     except Exception as e:
         st.error(f"[ERROR] Query failed: {e}")
         return pd.DataFrame(columns=["Time", "s1", "s2", "s3", "s4", "s5", "s6", "s7", "s8", "Smell"])
+    return df.copy()
+
+# warm-up thread เริ่มครั้งเดียวต่อ process: ปกติเริ่มตั้งแต่ server start (server.py)
+# ถ้ารันด้วย `streamlit run main.py` จะเริ่มตอนเปิดหน้าเว็บครั้งแรกแทน
+if client:
+    warmup.start_scheduler(client)
 
-if serial_numbers:
-    sn_counter = Counter(serial_numbers)
-    duplicate_count = sum(1 for v in sn_counter.values() if v > 1)
-    unique_count = len(sn_counter)
-    # นับเฉพาะ serial number จริง (ไม่รวม "-" และ "❌ ไม่เจอ...")
+if sn_index is not None and len(sn_index):
     actual_sn_count = len([sn for sn in unique_serial_numbers if sn != "-" and not sn.startswith("❌")])
-    st.write(f"Serial No. ที่แสดงใน dropdown : {actual_sn_count} ตัว | จากการ Query ทั้งหมด : {len(serial_numbers)} ตัว | ไม่ซ้ำ : {unique_count} ตัว | ซ้ำ : {duplicate_count} ตัว")
+    st.write(f"Serial No. ที่แสดงใน dropdown : {actual_sn_count} ตัว | จากการ Query ทั้งหมด : {sn_index.raw_count} ตัว | ไม่ซ้ำ : {len(sn_index)} ตัว | ซ้ำ : {sn_index.duplicate_count} ตัว")
 else:
     st.write("Serial No. ที่แสดงใน dropdown : 0 ตัว | จากการ Query ทั้งหมด : 0 ตัว | ไม่ซ้ำ : 0 ตัว | ซ้ำ : 0 ตัว")
 
 st.markdown("")
 
+# --- Live Mode ---
+# ระยะเวลา (วินาที) ระหว่างการ poll ข้อมูลใหม่
+LIVE_REFRESH_SECONDS = 15
+
+live_ready = client and selected_measurement != "-" and selected_sn not in ("-", "❌ ไม่เจอ - ค้นหาจาก Station")
+live_mode = st.toggle("📡 Live Mode (ติดตามข้อมูลล่าสุดของอุปกรณ์)", value=False, disabled=not live_ready)
+if live_mode and live_ready:
+    live_key = (selected_measurement, selected_sn, selected_station is not None)
+    live_label = st.text_input("Smell Label (Live)", value="Live", key="live_smell_label")
+
+    @st.fragment(run_every=LIVE_REFRESH_SECONDS)
+    def live_tail_panel():
+        # fragment rerun แยกจากการรันทั้งหน้า ต้องผูก operator ใหม่ทุกครั้ง
+        bind_operator()
+        tails = st.session_state.setdefault('live_tails', {})
+        if live_key not in tails:
+            tails[live_key] = liveTail.LiveTail()
+        tail = tails[live_key]
+        measurement, serial_no, use_station = live_key
+        fetched = tail.poll(
+            lambda cursor: query_to_dataframe(client, *build_live_query(measurement, serial_no, cursor, use_station)),
+            live_label
+        )
+        live_df = tail.to_frame()
+        st.caption(f"อัปเดตทุก {LIVE_REFRESH_SECONDS} วินาที | poll ล่าสุดได้ {fetched} แถว | ใน buffer {len(live_df)} แถว")
+        if not live_df.empty:
+            chart_df = live_df[processDataset.SENSOR_COLUMNS].copy()
+            chart_df.index = pd.to_datetime(chart_df.index, unit='s', utc=True).tz_convert('Asia/Bangkok')
+            st.line_chart(chart_df)
+            st.markdown("#### 📊 Live Fingerprint (running mean / std / min / max)")
+            st.dataframe(tail.aggregator.to_frame(), use_container_width=True)
+
+    live_tail_panel()
+    if st.button("🔄 เริ่ม Live ใหม่", key="reset_live"):
+        st.session_state.get('live_tails', {}).pop(live_key, None)
+        st.rerun()
+
 # ปุ่ม Export to CSV
 if st.button("Export to CSV", type="primary"):
     # Validation ที่ปรับปรุงแล้ว
@@ -310,8 +439,27 @@ if st.button("Export to CSV", type="primary"):
         st.session_state.selected_measurement = selected_measurement
         st.session_state.selected_sn = selected_sn
         st.session_state.use_station = (selected_station is not None)
+        st.session_state.pop('log_source', None)
+        warmup.usage.record(selected_measurement, selected_sn, selected_station is not None)
         st.rerun()
 
+# --- นำเข้าไฟล์ Log (ไม่ผ่าน InfluxDB) ---
+with st.expander("📂 นำเข้าไฟล์ Log (CSV/Parquet) จากอุปกรณ์ที่ไม่ได้เชื่อมต่อ InfluxDB", expanded=False):
+    log_upload = st.file_uploader("อัปโหลดไฟล์ Log (คอลัมน์ time และ s1-s8 หรือ a1-a8)", type=["csv", "parquet"])
+    log_path = ""
+    if sensor_log_dir:
+        log_path = st.text_input(f"หรือระบุชื่อไฟล์ใน {sensor_log_dir} บน server (แนะนำสำหรับไฟล์ขนาดใหญ่)").strip()
+    if st.button("ใช้ไฟล์ Log", key="use_log_file"):
+        resolved_path = resolve_log_path(log_path)
+        if log_path and resolved_path is None:
+            st.warning(f"⚠️ ไม่พบไฟล์ตาม path ที่ระบุ (ต้องอยู่ภายใน {sensor_log_dir})")
+        elif not log_path and log_upload is None:
+            st.warning("⚠️ กรุณาอัปโหลดไฟล์หรือระบุ path ก่อน")
+        else:
+            st.session_state.log_source = resolved_path or log_upload
+            st.session_state.show_split_config = True
+            st.rerun()
+
 
 # แสดงส่วน Split Configuration
 if st.session_state.get('show_split_config', False):
@@ -445,19 +593,26 @@ if st.session_state.get('show_split_config', False):
             else:
                 all_dfs = []
                 smell_name_mapping = {}
+                aggregator = processDataset.SmellAggregator()
 
-                for i, split in enumerate(st.session_state.splits):
+                split_ranges = []
+                for split in st.session_state.splits:
                     split_start_dt = bangkok_tz.localize(datetime.combine(split['start_date'], split['start_time']))
                     split_end_dt = bangkok_tz.localize(datetime.combine(split['end_date'], split['end_time']))
-                    split_start_unix = int(split_start_dt.timestamp())
-                    split_end_unix = int(split_end_dt.timestamp())
+                    split_ranges.append((int(split_start_dt.timestamp()), int(split_end_dt.timestamp())))
 
+                if st.session_state.get('log_source') is not None:
+                    # อ่านไฟล์ Log รอบเดียวแบบทีละ chunk แล้วติด label ให้ทุก split
+                    split_dfs = read_log_split_dataframes(st.session_state.log_source, split_ranges)
+                else:
+                    # รวมช่วงที่ซ้อน/ติดกันแล้ว query ครั้งเดียว ไม่ดึงข้อมูลซ้ำ
                     use_station = st.session_state.get('use_station', False)
-                    query = build_query(st.session_state.selected_measurement, st.session_state.selected_sn, split_start_unix, split_end_unix, use_station)
-                    df = query_to_dataframe(client, query)
+                    split_dfs = fetch_split_dataframes(client, st.session_state.selected_measurement, st.session_state.selected_sn, split_ranges, use_station)
 
+                for split, df in zip(st.session_state.splits, split_dfs):
                     if not df.empty:
                         df['Smell'] = split['smell_label']
+                        aggregator.update(df)
                         all_dfs.append(df)
                         smell_name_mapping[split['smell_label']] = split['smell_name']
 
@@ -474,6 +629,8 @@ if st.session_state.get('show_split_config', False):
                     excel_buffer = io.BytesIO()
                     name_df.to_excel(excel_buffer, index=False)
                     st.session_state.csv_files["smell_Name.xlsx"] = excel_buffer.getvalue()
+                    st.session_state.smell_aggregator = aggregator
+                    st.session_state.run_identity = run_identity(combined_df)
 
                     st.success(f"✅ ประมวลผลสำเร็จ! รวมข้อมูล {len(all_dfs)} splits ({len(combined_df)} แถว)")
 
@@ -482,6 +639,9 @@ if st.session_state.get('show_split_config', False):
 
                     st.markdown("#### 📝 Smell Name Mapping")
                     st.dataframe(name_df, use_container_width=True)
+
+                    st.markdown("#### 📊 Smell Fingerprint (running mean / std / min / max)")
+                    st.dataframe(aggregator.to_frame(), use_container_width=True)
                 else:
                     st.error("❌ ไม่พบข้อมูลในช่วงเวลาที่เลือก")
 
@@ -572,18 +732,30 @@ if st.session_state.get('show_split_config', False):
             else:
                 all_dfs = []
                 smell_name_mapping = {}
+                aggregator = processDataset.SmellAggregator()
 
-                for i, fp in enumerate(st.session_state.fixed_points):
+                fix_unixes = []
+                for fp in st.session_state.fixed_points:
                     fp_dt = bangkok_tz.localize(datetime.combine(fp['date'], fp['fix_time']))
-                    fix_unix = int(fp_dt.timestamp())
+                    fix_unixes.append(int(fp_dt.timestamp()))
 
+                if st.session_state.get('log_source') is not None:
+                    # แต่ละชุดคือ 1 bucket (1 วินาที หรือ 1 นาที) ของไฟล์ Log
+                    bucket = 1 if is_second else 60
+                    fp_ranges = [((u // bucket) * bucket, (u // bucket) * bucket + bucket) for u in fix_unixes]
+                    fp_dfs = read_log_split_dataframes(st.session_state.log_source, fp_ranges, bucket)
+                else:
+                    fp_dfs = []
                     use_station = st.session_state.get('use_station', False)
-                    query = build_fixed_point_query(st.session_state.selected_measurement, st.session_state.selected_sn, fix_unix, use_station, is_second)
-                    df = query_to_dataframe(client, query)
+                    for fix_unix in fix_unixes:
+                        query, bind_params = build_fixed_point_query(st.session_state.selected_measurement, st.session_state.selected_sn, fix_unix, use_station, is_second)
+                        fp_dfs.append(query_to_dataframe(client, query, bind_params))
 
+                for fp, df in zip(st.session_state.fixed_points, fp_dfs):
                     if not df.empty:
                         df = df.head(1)
                         df['Smell'] = fp['smell_label']
+                        aggregator.update(df)
                         all_dfs.append(df)
                         smell_name_mapping[fp['smell_label']] = fp['smell_name']
 
@@ -600,6 +772,8 @@ if st.session_state.get('show_split_config', False):
                     excel_buffer = io.BytesIO()
                     name_df.to_excel(excel_buffer, index=False)
                     st.session_state.csv_files["smell_Name.xlsx"] = excel_buffer.getvalue()
+                    st.session_state.smell_aggregator = aggregator
+                    st.session_state.run_identity = run_identity(combined_df)
 
                     st.success(f"✅ ประมวลผลสำเร็จ! {len(all_dfs)} ชุด ({len(combined_df)} แถว)")
 
@@ -608,6 +782,9 @@ if st.session_state.get('show_split_config', False):
 
                     st.markdown("#### 📝 Smell Name Mapping")
                     st.dataframe(name_df, use_container_width=True)
+
+                    st.markdown("#### 📊 Smell Fingerprint (running mean / std / min / max)")
+                    st.dataframe(aggregator.to_frame(), use_container_width=True)
                 else:
                     st.error("❌ ไม่พบข้อมูลในช่วงเวลาที่เลือก")
 
@@ -627,20 +804,42 @@ if st.session_state.csv_files:
         st.session_state.pop('use_station', None)
         st.session_state.pop('selected_measurement', None)
         st.session_state.pop('selected_sn', None)
+        st.session_state.pop('smell_aggregator', None)
+        st.session_state.pop('run_identity', None)
+        st.session_state.pop('log_source', None)
         st.session_state.splits = []
         st.session_state.fixed_points = []
         st.session_state.split_mode = '⚙️ กำหนด Time Range Splits'
         st.success("✅ ล้างไฟล์ใน Memory แล้ว")
         st.rerun()
 
+# คลัง Fingerprint ใช้ร่วมกันทุก session
+@st.cache_resource(show_spinner=False)
+def get_fingerprint_library():
+    return fingerprintLibrary.FingerprintLibrary()
+
 # --- Plot Model ---
 if "smell_label.csv" in st.session_state.csv_files and "smell_Name.xlsx" in st.session_state.csv_files:
     st.markdown("---")
     st.subheader("🔬 Plot Model (สร้างผลลัพธ์ทั้งหมด)")
+    feature_source = st.selectbox("ข้อมูลที่ใช้ทำ PCA/HCA :", ["ค่าเฉลี่ย s1-s8 (Mean)", "Sliding-window features (slope, steady, peak, AUC, ratio)"], index=0)
+    baseline_options = {
+        "ไม่ปรับ (ค่าดิบ)": (None, 'subtract'),
+        "ลบ Baseline Air Zero ทั้ง session": ('session', 'subtract'),
+        "ลบ Baseline Air Zero ล่าสุด (rolling)": ('rolling', 'subtract'),
+        "หารด้วย Baseline Air Zero ทั้ง session (ratio)": ('session', 'ratio'),
+        "หารด้วย Baseline Air Zero ล่าสุด (rolling ratio)": ('rolling', 'ratio'),
+    }
+    baseline_choice = st.selectbox("Baseline Correction (ใช้ Smell Label \"Air Zero\") :", list(baseline_options), index=0)
+    save_to_library = st.checkbox("💾 บันทึก fingerprint ของ run นี้ลงคลัง Fingerprint", value=False)
     if st.button("Plot Model", type="primary"):
         outputs = processDataset.process_smell_label(
             st.session_state.csv_files["smell_label.csv"],
-            io.BytesIO(st.session_state.csv_files["smell_Name.xlsx"])
+            io.BytesIO(st.session_state.csv_files["smell_Name.xlsx"]),
+            st.session_state.get('smell_aggregator'),
+            feature_mode='window' if feature_source.startswith("Sliding") else 'mean',
+            baseline=baseline_options[baseline_choice][0],
+            baseline_method=baseline_options[baseline_choice][1]
         )
 
         # แสดงตาราง CSV
@@ -650,6 +849,14 @@ if "smell_label.csv" in st.session_state.csv_files and "smell_Name.xlsx" in st.s
         st.dataframe(pd.read_csv(io.StringIO(outputs["dataset.csv"])))
         st.markdown("#### average_smell_sensor_values.csv")
         st.dataframe(pd.read_csv(io.StringIO(outputs["average_smell_sensor_values.csv"])))
+        st.markdown("#### smell_fingerprint_stats.csv")
+        st.dataframe(pd.read_csv(io.StringIO(outputs["smell_fingerprint_stats.csv"])))
+        st.markdown("#### smell_window_features.csv")
+        st.dataframe(pd.read_csv(io.StringIO(outputs["smell_window_features.csv"])))
+        baseline_report = pd.read_csv(io.StringIO(outputs["baseline_correction.csv"])).iloc[0]
+        if baseline_report['Uncorrected_Cells']:
+            st.warning(f"⚠️ Baseline correction: {baseline_report['Uncorrected_Cells']} ค่าไม่มี baseline (ก่อน Air Zero แรก หรือ baseline เป็น 0) "
+                       f"ถูกเว้นว่างไว้ และตัดออก {baseline_report['Dropped_Rows']} แถว")
 
         # แสดง radar chart
         st.markdown("#### Radar Chart (PNG)")
@@ -669,6 +876,44 @@ if "smell_label.csv" in st.session_state.csv_files and "smell_Name.xlsx" in st.s
         for fname in sorted(hca_files):
             st.image(outputs[fname], caption=fname, use_container_width=True)
 
+        # แสดงผลการวัด separability
+        st.markdown("#### 🎯 Smell Separability (k-fold cross-validation)")
+        st.dataframe(pd.read_csv(io.StringIO(outputs["evaluation/separability.csv"])), use_container_width=True)
+        if "evaluation/cv_summary.csv" in outputs:
+            st.dataframe(pd.read_csv(io.StringIO(outputs["evaluation/cv_summary.csv"])), use_container_width=True)
+            confusion_files = sorted(k for k in outputs if k.startswith("evaluation/confusion_matrix_"))
+            with st.expander("Confusion Matrix", expanded=False):
+                for fname in confusion_files:
+                    st.markdown(f"**{fname.split('confusion_matrix_')[-1][:-4]}**")
+                    st.dataframe(pd.read_csv(io.StringIO(outputs[fname]), index_col=0), use_container_width=True)
+
+        # เทียบกับคลัง Fingerprint จากทุก run/อุปกรณ์
+        library = get_fingerprint_library()
+        average_df = pd.read_csv(io.StringIO(outputs["average_smell_sensor_values.csv"]))
+        device, run_date, run_id = st.session_state.get('run_identity', ("-", "-", "-"))
+        baseline_mode = baseline_report['Baseline']
+        st.markdown(f"#### 🔎 กลิ่นที่ใกล้เคียงที่สุดในคลัง Fingerprint ({len(library)} รายการ, เทียบเฉพาะ Baseline: {baseline_mode})")
+        # ไม่นับ run นี้เอง ที่อาจบันทึกไว้จากการกดครั้งก่อน
+        nearest_df = library.nearest(average_df[processDataset.SENSOR_COLUMNS].fillna(0).values, k=5,
+                                     exclude=(device, run_date, run_id), baseline=baseline_mode)
+        if len(nearest_df):
+            nearest_df.insert(0, 'Smell', average_df['Name'].fillna(average_df['Smell']).values[nearest_df.pop('Query')])
+            st.dataframe(nearest_df, use_container_width=True)
+            buf_nearest = io.StringIO()
+            nearest_df.to_csv(buf_nearest, index=False)
+            outputs["fingerprint_nearest.csv"] = buf_nearest.getvalue()
+        else:
+            st.info("ยังไม่มี fingerprint จาก run อื่นในคลัง")
+        if save_to_library:
+            library.add(average_df, device, run_date, run_id, baseline_mode)
+        similarity_df = library.similarity_matrix(device=device, baseline=baseline_mode)
+        if len(similarity_df):
+            with st.expander(f"Similarity ระหว่าง fingerprint ของ {device} ในคลัง (ล่าสุด {len(similarity_df)} รายการ)", expanded=False):
+                st.dataframe(similarity_df, use_container_width=True)
+            buf_similarity = io.StringIO()
+            similarity_df.to_csv(buf_similarity)
+            outputs["fingerprint_similarity.csv"] = buf_similarity.getvalue()
+
         # ปุ่มดาวน์โหลด zip
         zip_buffer = io.BytesIO()
         with zipfile.ZipFile(zip_buffer, "w") as zf:
@@ -676,6 +921,18 @@ if "smell_label.csv" in st.session_state.csv_files and "smell_Name.xlsx" in st.s
                 zf.writestr(fname, content if isinstance(content, bytes) else content.encode("utf-8"))
         st.download_button("Download All Output (ZIP)", data=zip_buffer.getvalue(), file_name="smell_model_outputs.zip")
 
+# --- InfluxDB Metrics ---
+with st.sidebar.expander("📈 InfluxDB Query Metrics", expanded=False):
+    metrics_summary = influx_metrics.summary()
+    if metrics_summary:
+        st.dataframe(pd.DataFrame(metrics_summary), use_container_width=True)
+        st.markdown("**ราย Operator (session)**")
+        st.dataframe(pd.DataFrame(influx_metrics.operator_summary()), use_container_width=True)
+        st.caption(f"Slow-query log (≥ {influx_metrics.slow_query_ms:.0f} ms): {influx_metrics.slow_query_log}")
+        st.download_button("ดาวน์โหลด metrics (Prometheus)", data=influx_metrics.to_prometheus(), file_name="influx_metrics.prom")
+    else:
+        st.caption("ยังไม่มี query")
+
 # กัน SQL Injection
 if selected_measurement not in measurements:
     st.error("Measurement ไม่ถูกต้อง")
@@ -685,8 +942,7 @@ if selected_measurement not in measurements:
 if selected_station:
     # ถ้าใช้ Station ให้ตรวจว่า station ถูกต้องหรือไม่
     if client and selected_measurement != "-":
-        valid_stations = get_station_names(client, selected_measurement)
-        if selected_station not in valid_stations:
+        if selected_station not in get_tag_index(selected_measurement, "sName"):
             st.error("Station ไม่ถูกต้อง")
             st.stop()
 else:
@@ -3,15 +3,400 @@ import matplotlib.pyplot as plt
 import numpy as np
 import io
 import re
+import os
+import tempfile
+import threading
+import multiprocessing
 from sklearn.decomposition import PCA
 from sklearn.preprocessing import StandardScaler
+from sklearn.pipeline import make_pipeline
+from sklearn.model_selection import StratifiedKFold
+from sklearn.neighbors import NearestCentroid, KNeighborsClassifier
+from sklearn.discriminant_analysis import LinearDiscriminantAnalysis
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import accuracy_score, f1_score, confusion_matrix, silhouette_score
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from scipy.cluster.hierarchy import dendrogram, linkage
-from scipy.spatial.distance import pdist
+from scipy.spatial.distance import pdist, squareform
 
-def process_smell_label(smell_label_csv, smell_name_excel):
+SENSOR_COLUMNS = ['s1', 's2', 's3', 's4', 's5', 's6', 's7', 's8']
+
+class SmellAggregator:
+    """
+    สะสมค่า count / mean / variance / min / max ของแต่ละ Smell และ Sensor แบบ streaming
+    (Welford + Chan merge) ไม่ต้องเก็บหรือ sort ข้อมูลทั้งหมดไว้ใน memory
+    """
+    def __init__(self, sensors=SENSOR_COLUMNS):
+        self.sensors = list(sensors)
+        self.count = None
+        self.mean = None
+        self.m2 = None
+        self.min = None
+        self.max = None
+
+    def update(self, df, smell=None):
+        """
+        df: DataFrame ที่มีคอลัมน์ s1-s8 (ตัวเลขหรือ string จาก query_to_dataframe)
+        smell: label ของทั้ง chunk ถ้าไม่ระบุจะใช้คอลัมน์ 'Smell'
+        """
+        if df is None or df.empty:
+            return
+        values = df[self.sensors].apply(pd.to_numeric, errors='coerce')
+        keys = pd.Series(smell, index=df.index) if smell is not None else df['Smell']
+        keys = keys.where(keys.notna() & (keys.astype(str).str.strip() != ''))
+        grouped = values.groupby(keys, sort=False)
+
+        n_b = grouped.count().astype(float)
+        mean_b = grouped.mean()
+        m2_b = grouped.var(ddof=0) * n_b
+        min_b = grouped.min()
+        max_b = grouped.max()
+        if n_b.empty:
+            return
+
+        if self.count is None:
+            self.count, self.mean, self.m2, self.min, self.max = n_b, mean_b, m2_b.fillna(0), min_b, max_b
+            return
+
+        # Chan et al. parallel merge ของ chunk ใหม่เข้ากับค่าที่สะสมไว้
+        idx = self.count.index.union(n_b.index, sort=False)
+        n_a = self.count.reindex(idx, fill_value=0)
+        n_b = n_b.reindex(idx, fill_value=0)
+        mean_a = self.mean.reindex(idx).fillna(0)
+        mean_b = mean_b.reindex(idx).fillna(0)
+        n = n_a + n_b
+        safe_n = n.where(n > 0)
+        delta = mean_b - mean_a
+
+        self.mean = mean_a + delta * n_b / safe_n
+        self.m2 = (self.m2.reindex(idx).fillna(0) + m2_b.reindex(idx).fillna(0)
+                   + delta ** 2 * n_a * n_b / safe_n).fillna(0)
+        self.min = pd.DataFrame(np.fmin(self.min.reindex(idx).values, min_b.reindex(idx).values),
+                                index=idx, columns=self.sensors)
+        self.max = pd.DataFrame(np.fmax(self.max.reindex(idx).values, max_b.reindex(idx).values),
+                                index=idx, columns=self.sensors)
+        self.count = n
+
+    def smells(self):
+        return [] if self.count is None else list(self.count.index)
+
+    def mean_values(self, smells=None):
+        """ค่าเฉลี่ย s1-s8 ต่อ Smell (index=Smell) เรียงตาม smells ถ้าระบุ"""
+        if self.count is None:
+            return pd.DataFrame(columns=self.sensors)
+        mean = self.mean.where(self.count > 0)
+        return mean.reindex(smells) if smells is not None else mean
+
+    def to_frame(self, smells=None):
+        """ตาราง fingerprint: Smell, Count และ <sensor>_mean/_std/_min/_max"""
+        if self.count is None:
+            return pd.DataFrame(columns=['Smell', 'Count'])
+        order = smells if smells is not None else self.smells()
+        count = self.count.reindex(order)
+        variance = (self.m2.reindex(order) / (count - 1).where(count > 1))
+        stats = {'Count': count.max(axis=1).fillna(0).astype(int)}
+        for s in self.sensors:
+            stats[f'{s}_mean'] = self.mean_values(order)[s]
+            stats[f'{s}_std'] = np.sqrt(variance[s])
+            stats[f'{s}_min'] = self.min.reindex(order)[s]
+            stats[f'{s}_max'] = self.max.reindex(order)[s]
+        out = pd.DataFrame(stats, index=order).round(2)
+        out.index.name = 'Smell'
+        return out.reset_index()
+
+BASELINE_LABEL = 'Air Zero'
+# รูปแบบคอลัมน์ Time ใน smell_label.csv
+LABEL_TIME_FORMAT = '%d/%m/%Y  %H:%M:%S'
+
+def sort_by_time(df, time_column='Time'):
+    """เรียงแถวตามคอลัมน์ Time แบบ stable (แถวที่อ่านเวลาไม่ได้อยู่ท้ายสุด) ถ้าไม่มีคอลัมน์ Time คืน df เดิม"""
+    if time_column not in df.columns or len(df) < 2:
+        return df
+    times = pd.to_datetime(df[time_column], format=LABEL_TIME_FORMAT, errors='coerce')
+    if times.isna().all() or times.is_monotonic_increasing:
+        return df
+    return df.iloc[np.argsort(times.to_numpy(), kind='stable')]
+
+class BaselineCorrector:
+    """
+    ปรับค่า s1-s8 เทียบกับ baseline จาก Air Zero แบบ vectorized ทีละ chunk
+    ผู้เรียกต้องส่ง chunk ตามลำดับเวลา (chunk หลังต้องใหม่กว่า chunk ก่อน) แถวภายใน chunk ถูกเรียงตาม Time ให้
+    - baseline ที่ให้มา (session): ใช้ค่าเดียวทั้ง session เช่นค่าเฉลี่ย Air Zero ทั้งหมด
+    - rolling (ไม่ระบุ baseline): แต่ละแถวใช้ค่าเฉลี่ยของ Air Zero window ล่าสุดก่อนหน้า
+      (แถวใน Air Zero ใช้ค่าเฉลี่ยสะสมของ window นั้น) สถานะข้าม chunk ถูกเก็บไว้ จึงใช้กับข้อมูล streaming ได้
+    method: 'subtract' (ค่า - baseline) หรือ 'ratio' (ค่า / baseline)
+    ค่าที่ปรับไม่ได้ (ก่อน Air Zero แรกในโหมด rolling หรือ baseline เป็น 0 ในโหมด ratio) จะเป็น NaN ไม่ใช่ค่าดิบ
+    และนับไว้ใน uncorrected_cells ผลลัพธ์จึงเท่ากันไม่ว่าจะส่งข้อมูลมาทีละ chunk หรือทั้งหมดครั้งเดียว
+    """
+    def __init__(self, method='subtract', baseline=None, sensors=SENSOR_COLUMNS, baseline_label=BASELINE_LABEL):
+        self.method = method
+        self.sensors = list(sensors)
+        self.baseline_label = baseline_label
+        self.fixed_baseline = None if baseline is None else pd.Series(baseline, dtype='float64').reindex(self.sensors)
+        self.baseline = None
+        self._in_air = False
+        self._run_sum = pd.Series(0.0, index=self.sensors)
+        self._run_count = pd.Series(0.0, index=self.sensors)
+        self.uncorrected_cells = 0
+
+    def _rolling_baseline(self, values, is_air):
+        prev_air = np.r_[self._in_air, is_air[:-1]]
+        run_id = np.cumsum(is_air & ~prev_air)
+        air_values = values.where(pd.Series(is_air, index=values.index), axis=0)
+        run_sum = air_values.fillna(0).groupby(run_id).cumsum()
+        run_count = air_values.notna().astype(float).groupby(run_id).cumsum()
+        if self._in_air:
+            # Air Zero window ต่อเนื่องมาจาก chunk ก่อนหน้า
+            continuing = run_id == 0
+            run_sum[continuing] += self._run_sum
+            run_count[continuing] += self._run_count
+        baseline = (run_sum / run_count.where(run_count > 0)).where(pd.Series(is_air, index=values.index), axis=0).ffill()
+        if self.baseline is not None:
+            baseline = baseline.fillna(self.baseline)
+
+        self._in_air = bool(is_air[-1])
+        if self._in_air:
+            self._run_sum, self._run_count = run_sum.iloc[-1], run_count.iloc[-1]
+        if baseline.iloc[-1].notna().any():
+            self.baseline = baseline.iloc[-1]
+        return baseline
+
+    def transform(self, df):
+        """คืน DataFrame ใหม่ (เรียงตาม Time) ที่ s1-s8 ถูกปรับด้วย baseline แล้ว (ค่าที่ไม่มี baseline เป็น NaN)"""
+        if df is None or df.empty:
+            return df
+        df = sort_by_time(df)
+        values = df[self.sensors].apply(pd.to_numeric, errors='coerce')
+        if self.fixed_baseline is not None:
+            baseline = pd.DataFrame([self.fixed_baseline.values], columns=self.sensors).reindex(range(len(df))).ffill()
+            baseline.index = values.index
+        else:
+            is_air = (df['Smell'].astype(str) == self.baseline_label).to_numpy()
+            baseline = self._rolling_baseline(values, is_air)
+        if self.method == 'ratio':
+            corrected = values / baseline.where(baseline != 0)
+        else:
+            corrected = values - baseline
+        self.uncorrected_cells += int((corrected.isna() & values.notna()).to_numpy().sum())
+        out = df.copy()
+        out[self.sensors] = corrected
+        return out
+
+WINDOW_FEATURES = ['rise_slope', 'time_to_steady', 'peak', 'steady_level', 'auc']
+
+def sensor_window_features(X, window=5, steady_tol=0.02):
+    """
+    คำนวณ feature ของ response จาก array (n_samples, n_sensors) ที่เรียงตามเวลา ด้วย sliding window (ไม่มี loop ต่อ sample)
+    - rise_slope: slope สูงสุดของ linear fit ในแต่ละ window (หน่วยต่อ sample)
+    - time_to_steady: จำนวน sample จนถึง window แรกที่ std/mean <= steady_tol หลังจุดที่ขึ้นเร็วที่สุด
+      (ไม่นับช่วงนิ่งก่อนได้รับกลิ่น)
+    - peak: ค่าสูงสุด
+    - steady_level: ค่าเฉลี่ยของ window สุดท้าย
+    - auc: พื้นที่ใต้กราฟ (trapezoid, dt = 1 sample)
+    return: dict {feature: array (n_sensors,)}
+    """
+    X = np.asarray(X, dtype='float64')
+    n = len(X)
+    window = max(1, min(window, n))
+    # view แบบ strided (ไม่ copy ข้อมูล) ขนาด (n - window + 1, n_sensors, window)
+    windows = np.lib.stride_tricks.sliding_window_view(X, window, axis=0)
+    w_mean = windows.mean(axis=2)
+    w_sq_mean = np.lib.stride_tricks.sliding_window_view(X ** 2, window, axis=0).mean(axis=2)
+    w_std = np.sqrt(np.maximum(w_sq_mean - w_mean ** 2, 0))
+
+    if window > 1:
+        # t อยู่กึ่งกลางที่ 0 จึงไม่ต้องลบค่าเฉลี่ยของ window ก่อนคูณ
+        t = np.arange(window) - (window - 1) / 2
+        slopes = np.einsum('jsk,k->js', windows, t) / (t ** 2).sum()
+        rise_slope = slopes.max(axis=0)
+        onset = slopes.argmax(axis=0)
+    else:
+        rise_slope = np.zeros(X.shape[1])
+        onset = X.argmax(axis=0)
+
+    steady = w_std <= steady_tol * np.maximum(np.abs(w_mean), 1)
+    steady &= np.arange(len(w_std))[:, None] >= onset
+    time_to_steady = np.where(steady.any(axis=0), steady.argmax(axis=0), n).astype('float64')
+
+    return {
+        'rise_slope': rise_slope,
+        'time_to_steady': time_to_steady,
+        'peak': X.max(axis=0),
+        'steady_level': w_mean[-1],
+        'auc': ((X[1:] + X[:-1]) / 2).sum(axis=0) if n > 1 else X[0].copy(),
+    }
+
+def extract_window_features(df, sensors=SENSOR_COLUMNS, window=5, steady_tol=0.02):
+    """
+    feature ต่อ Smell จากแถวที่เรียงตามเวลา: <sensor>_<feature> และ <sensor>_ratio
+    (สัดส่วน steady_level ของ sensor ต่อผลรวมทุก sensor)
+    return: DataFrame index=Smell
+    """
+    values = df[sensors].apply(pd.to_numeric, errors='coerce')
+    features = {}
+    for smell, group in values.groupby(df['Smell'], sort=False, observed=True):
+        X = group.ffill().bfill().fillna(0).to_numpy()
+        if len(X) == 0:
+            continue
+        feats = sensor_window_features(X, window, steady_tol)
+        row = {f'{s}_{name}': feats[name][i] for name in WINDOW_FEATURES for i, s in enumerate(sensors)}
+        total = feats['steady_level'].sum()
+        for i, s in enumerate(sensors):
+            row[f'{s}_ratio'] = feats['steady_level'][i] / total if total else 0.0
+        features[smell] = row
+    out = pd.DataFrame.from_dict(features, orient='index')
+    out.index.name = 'Smell'
+    return out
+
+EVAL_MODELS = ['NearestCentroid', 'KNN', 'LDA', 'RandomForest']
+# จำกัดจำนวนแถวที่ใช้คำนวณ silhouette (O(n^2))
+SILHOUETTE_SAMPLE_SIZE = 5000
+
+def _make_model(name, seed, n_train=5):
+    if name == 'NearestCentroid':
+        model = NearestCentroid()
+    elif name == 'KNN':
+        # fold ที่มีแถว train น้อยกว่า 5 แถวใช้เพื่อนบ้านเท่าที่มี
+        model = KNeighborsClassifier(n_neighbors=max(1, min(5, n_train)))
+    elif name == 'LDA':
+        model = LinearDiscriminantAnalysis()
+    else:
+        model = RandomForestClassifier(n_estimators=100, random_state=seed, n_jobs=1)
+    return make_pipeline(StandardScaler(), model)
+
+# process pool เดียวใช้ร่วมกันทั้ง server (สร้างครั้งแรกที่ใช้)
+# ใช้ spawn เพราะ fork จาก Streamlit server ที่มีหลาย thread อาจติด lock ที่ถูก copy มาค้างไว้
+_eval_executor = None
+_eval_executor_lock = threading.Lock()
+
+def _get_eval_executor(max_workers=None):
+    global _eval_executor
+    with _eval_executor_lock:
+        if _eval_executor is None:
+            _eval_executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+        return _eval_executor
+
+def _reset_eval_executor(executor):
+    global _eval_executor
+    with _eval_executor_lock:
+        if _eval_executor is executor:
+            _eval_executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+def _evaluate_fold(model_name, fold, X, y, train_idx, test_idx, seed):
+    """return: (model_name, fold, test_idx, y_pred, error) โดย y_pred เป็น None ถ้า fold นี้ fit ไม่ได้"""
+    try:
+        model = _make_model(model_name, seed, len(train_idx))
+        model.fit(X[train_idx], y[train_idx])
+        return model_name, fold, test_idx, model.predict(X[test_idx]), None
+    except Exception as e:
+        return model_name, fold, test_idx, None, f"{type(e).__name__}: {e}"
+
+_worker_data = {}
+
+def _load_eval_data(data_path):
+    # worker โหลด X / y จากไฟล์ครั้งเดียวต่อการประเมิน ไม่ต้อง pickle ข้อมูลไปกับทุก task
+    if _worker_data.get('path') != data_path:
+        with np.load(data_path) as data:
+            _worker_data.update(path=data_path, X=data['X'], y=data['y'])
+    return _worker_data['X'], _worker_data['y']
+
+def _evaluate_fold_task(model_name, fold, data_path, train_idx, test_idx, seed):
+    X, y = _load_eval_data(data_path)
+    return _evaluate_fold(model_name, fold, X, y, train_idx, test_idx, seed)
+
+def evaluate_separability(dataset_df, n_splits=5, seed=42, max_workers=None):
+    """
+    วัดว่าแต่ละกลิ่นแยกกันได้ดีแค่ไหนจากแถวดิบ (dataset.csv)
+    - k-fold cross-validation (StratifiedKFold, seed คงที่) ของหลาย classifier รันขนานบน process pool กลาง
+      1 task ต่อ (model, fold) (max_workers มีผลเฉพาะครั้งแรกที่สร้าง pool)
+      fold ที่ error จะถูกบันทึกไว้ใน cv_folds / cv_summary
+    - silhouette score และ confusion matrix ของแต่ละ model
+    return: dict {filename: csv}
+    """
+    data = dataset_df.copy()
+    data[SENSOR_COLUMNS] = data[SENSOR_COLUMNS].apply(pd.to_numeric, errors='coerce')
+    data = data.dropna(subset=SENSOR_COLUMNS + ['Smell'])
+    X = data[SENSOR_COLUMNS].to_numpy(dtype='float64')
+    y = data['Smell'].astype(str).to_numpy()
+    labels = list(dict.fromkeys(data['Smell'].astype(str)))
+    class_counts = pd.Series(y).value_counts()
+
+    summary = {'Samples': len(y), 'Smells': len(labels)}
+    if len(labels) > 1 and len(y) > len(labels):
+        sample_size = min(SILHOUETTE_SAMPLE_SIZE, len(y))
+        summary['Silhouette'] = round(float(silhouette_score(StandardScaler().fit_transform(X), y, sample_size=sample_size, random_state=seed)), 4)
+
+    outputs = {}
+    n_splits = min(n_splits, int(class_counts.min())) if len(class_counts) else 0
+    if len(labels) < 2 or n_splits < 2:
+        summary['Note'] = 'ข้อมูลไม่พอสำหรับ cross-validation (ต้องมีอย่างน้อย 2 กลิ่น และกลิ่นละ 2 แถว)'
+        outputs['evaluation/separability.csv'] = pd.DataFrame([summary]).to_csv(index=False)
+        return outputs
+
+    folds = list(StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=seed).split(X, y))
+    tasks = [(name, fold, train_idx, test_idx) for name in EVAL_MODELS for fold, (train_idx, test_idx) in enumerate(folds)]
+    executor = None
+    fd, data_path = tempfile.mkstemp(suffix='.npz', prefix='separability_')
+    os.close(fd)
+    try:
+        # ข้อมูลส่งไปแต่ละ worker ผ่านไฟล์ครั้งเดียว (pool ใช้ร่วมกันจึงใช้ initializer ต่อการประเมินไม่ได้)
+        np.savez(data_path, X=X, y=y.astype(str))
+        executor = _get_eval_executor(max_workers)
+        futures = [executor.submit(_evaluate_fold_task, name, fold, data_path, train_idx, test_idx, seed)
+                   for name, fold, train_idx, test_idx in tasks]
+        results = [future.result() for future in futures]
+    except (OSError, BrokenProcessPool) as e:
+        # บางเครื่องสร้าง process ไม่ได้ ให้รันแบบ serial แทน (ผลลัพธ์เหมือนกันเพราะ seed คงที่)
+        print(f"[WARN] Process pool unavailable, evaluating serially: {e}")
+        if executor is not None:
+            _reset_eval_executor(executor)
+        results = [_evaluate_fold(name, fold, X, y, train_idx, test_idx, seed) for name, fold, train_idx, test_idx in tasks]
+    finally:
+        os.remove(data_path)
+
+    predictions = {name: np.empty(len(y), dtype=object) for name in EVAL_MODELS}
+    fold_rows = []
+    for model_name, fold, test_idx, y_pred, error in results:
+        if error is not None:
+            print(f"[ERROR] {model_name} fold {fold + 1} failed: {error}")
+            fold_rows.append({'Model': model_name, 'Fold': fold + 1, 'Accuracy': np.nan, 'Macro_F1': np.nan, 'Error': error})
+            continue
+        predictions[model_name][test_idx] = y_pred
+        fold_rows.append({'Model': model_name, 'Fold': fold + 1,
+                          'Accuracy': accuracy_score(y[test_idx], y_pred),
+                          'Macro_F1': f1_score(y[test_idx], y_pred, average='macro'),
+                          'Error': ''})
+    fold_df = pd.DataFrame(fold_rows).sort_values(['Model', 'Fold'])
+    grouped = fold_df.groupby('Model', sort=False)
+    cv_summary = grouped[['Accuracy', 'Macro_F1']].agg(['mean', 'std'])
+    cv_summary.columns = [f'{metric}_{stat}' for metric, stat in cv_summary.columns]
+    cv_summary['Failed_Folds'] = grouped['Error'].agg(lambda errors: int((errors != '').sum()))
+    cv_summary['Error'] = grouped['Error'].agg(lambda errors: next((e for e in errors if e), ''))
+    cv_summary = cv_summary.reindex(EVAL_MODELS).round(4).reset_index()
+
+    summary['Folds'] = n_splits
+    summary['Nearest_Centroid_Accuracy'] = cv_summary.loc[cv_summary['Model'] == 'NearestCentroid', 'Accuracy_mean'].iloc[0]
+    outputs['evaluation/separability.csv'] = pd.DataFrame([summary]).to_csv(index=False)
+    outputs['evaluation/cv_summary.csv'] = cv_summary.to_csv(index=False)
+    outputs['evaluation/cv_folds.csv'] = fold_df.round(4).to_csv(index=False)
+    for model_name in EVAL_MODELS:
+        matrix = confusion_matrix(y, predictions[model_name].astype(str), labels=labels)
+        outputs[f'evaluation/confusion_matrix_{model_name}.csv'] = pd.DataFrame(matrix, index=labels, columns=labels).to_csv()
+    return outputs
+
+def process_smell_label(smell_label_csv, smell_name_excel, aggregator=None, feature_mode='mean', evaluate=True,
+                        baseline=None, baseline_method='subtract'):
     """
     smell_label_csv: str (csv) หรือ BytesIO
     smell_name_excel: BytesIO (excel)
+    aggregator: SmellAggregator ที่สะสมไว้ระหว่าง export (ถ้าไม่ระบุจะคำนวณจาก csv)
+    feature_mode: 'mean' ใช้ค่าเฉลี่ย s1-s8 หรือ 'window' ใช้ sliding-window features สำหรับ PCA/HCA
+    evaluate: วัด separability ของกลิ่นด้วย cross-validation (evaluation/*.csv)
+    baseline: None, 'session' (ค่าเฉลี่ย Air Zero ทั้ง session) หรือ 'rolling' (Air Zero window ล่าสุด)
+    baseline_method: 'subtract' หรือ 'ratio'
+      แถวที่ปรับ baseline ไม่ได้เลย (ก่อน Air Zero แรก) จะถูกตัดออก และรายงานใน baseline_correction.csv
     return: dict {filename: content}
     """
     # --- Step 1: Extract and Sort Labeled Data ---
@@ -19,6 +404,32 @@ def process_smell_label(smell_label_csv, smell_name_excel):
     filtered_df = df[df['Smell'].notna() & (df['Smell'].astype(str).str.strip() != '')]
     labels = filtered_df['Smell'].dropna().unique()
 
+    # Baseline correction ด้วย Air Zero (ทำก่อนทุกขั้นตอน ลำดับแถวยังเป็นลำดับเวลาเดิม)
+    if baseline and (filtered_df['Smell'].astype(str) == BASELINE_LABEL).any():
+        session_baseline = None
+        if baseline == 'session':
+            if aggregator is None:
+                aggregator = SmellAggregator()
+                aggregator.update(filtered_df)
+            session_baseline = aggregator.mean_values([BASELINE_LABEL]).iloc[0]
+        corrector = BaselineCorrector(baseline_method, session_baseline)
+        # smell_label.csv เรียงตามลำดับ split ที่ operator ใส่ ไม่ใช่ลำดับเวลา
+        filtered_df = corrector.transform(sort_by_time(filtered_df))
+        # ไม่ปนค่าดิบกับค่าที่ปรับแล้ว: แถวที่ไม่มี baseline เลยถูกตัดออก
+        uncorrected_rows = filtered_df[SENSOR_COLUMNS].isna().all(axis=1)
+        filtered_df = filtered_df[~uncorrected_rows]
+        labels = filtered_df['Smell'].dropna().unique()
+        # ค่าเฉลี่ยเดิมเป็นค่าดิบ ต้องคำนวณใหม่จากข้อมูลที่ปรับแล้ว
+        aggregator = None
+        baseline_report = {'Baseline': f'{baseline}-{baseline_method}', 'Uncorrected_Cells': corrector.uncorrected_cells,
+                           'Dropped_Rows': int(uncorrected_rows.sum())}
+        if baseline_report['Uncorrected_Cells']:
+            print(f"[WARN] Baseline correction left {baseline_report['Uncorrected_Cells']} values without a baseline "
+                  f"({baseline_report['Dropped_Rows']} rows dropped)")
+    else:
+        baseline = None
+        baseline_report = {'Baseline': 'raw', 'Uncorrected_Cells': 0, 'Dropped_Rows': 0}
+
     def smell_sort_key(label):
         if label == 'Air Zero':
             return 0
@@ -40,10 +451,18 @@ def process_smell_label(smell_label_csv, smell_name_excel):
     dataset_df.to_csv(buf_dataset, index=False)
 
     # --- Step 2: Generate Radar Charts from Sorted Data ---
-    avg_values = dataset_df.groupby('Smell').mean(numeric_only=True)
+    # ใช้ค่าเฉลี่ยจาก SmellAggregator (running mean) แทนการ groupby ข้อมูลทั้งหมดซ้ำ
+    if aggregator is None:
+        aggregator = SmellAggregator()
+        aggregator.update(filtered_df)
+    avg_values = aggregator.mean_values(sorted_labels)
+    avg_values.index.name = 'Smell'
     avg_values_rounded = avg_values.round(2)
     avg_values_rounded = avg_values_rounded.reset_index()
 
+    buf_stats = io.StringIO()
+    aggregator.to_frame(sorted_labels).to_csv(buf_stats, index=False)
+
     # Load smell names from Excel
     name_map_df = pd.read_excel(smell_name_excel)
     name_map_df = name_map_df[['Smell', 'Name']]
@@ -57,6 +476,11 @@ def process_smell_label(smell_label_csv, smell_name_excel):
     buf_avg = io.StringIO()
     average_with_names.to_csv(buf_avg, index=False)
 
+    # Sliding-window features ต่อ Smell (ใช้ลำดับเวลาเดิมของแถว ไม่ใช่ลำดับหลัง sort)
+    window_features = extract_window_features(filtered_df).reindex(sorted_labels)
+    buf_features = io.StringIO()
+    window_features.round(4).reset_index().to_csv(buf_features, index=False)
+
     # Prepare radar chart (in memory)
     sensor_labels = [col for col in average_with_names.columns if col not in ['Smell', 'Name']]
     num_vars = len(sensor_labels)
@@ -73,7 +497,8 @@ def process_smell_label(smell_label_csv, smell_name_excel):
         fig, ax = plt.subplots(figsize=(6, 6), subplot_kw=dict(polar=True))
         ax.set_theta_offset(np.pi / 2) #type: ignore
         ax.set_theta_direction(-1) #type: ignore
-        ax.set_ylim(0, 1024)
+        if not baseline:
+            ax.set_ylim(0, 1024)
         ax.plot(angles, values, marker='o')
         ax.fill(angles, values, alpha=0.25)
         ax.set_xticks(angles[:-1])
@@ -89,8 +514,15 @@ def process_smell_label(smell_label_csv, smell_name_excel):
     # --- Step 3: PCA Analysis ---
     pca_outputs = {}
     
-    # Extract features (s1-s8) for PCA
-    X = average_with_names[sensor_labels].values
+    # Extract features (s1-s8 หรือ sliding-window features) for PCA
+    if feature_mode == 'window':
+        feature_labels = list(window_features.columns)
+        feature_table = window_features.reindex(average_with_names['Smell']).fillna(0)
+    else:
+        feature_labels = sensor_labels
+        # sensor ที่ปรับ baseline ไม่ได้ทั้งกลิ่นมีค่าเฉลี่ยเป็น NaN
+        feature_table = average_with_names[sensor_labels].fillna(0)
+    X = feature_table.values
     smell_labels = average_with_names['Smell'].values
     name_labels = average_with_names['Name'].fillna(average_with_names['Smell']).values
     
@@ -128,7 +560,7 @@ def process_smell_label(smell_label_csv, smell_name_excel):
     loadings_df = pd.DataFrame(
         pca.components_.T,
         columns=[f'PC{i+1}' for i in range(len(pca.components_))],
-        index=sensor_labels
+        index=feature_labels
     ).round(3)
     loadings_df.insert(0, 'Sensor', loadings_df.index)
     buf_load = io.StringIO()
@@ -185,7 +617,7 @@ def process_smell_label(smell_label_csv, smell_name_excel):
     hca_outputs = {}
     
     # Use the same standardized data as PCA
-    X_scaled = scaler.fit_transform(average_with_names[sensor_labels])
+    X_scaled = scaler.fit_transform(feature_table)
     
     # Compute linkage matrix using Ward's method
     linkage_matrix = linkage(X_scaled, method='ward')
@@ -221,13 +653,30 @@ def process_smell_label(smell_label_csv, smell_name_excel):
     linkage_df.to_csv(buf_linkage, index=False)
     hca_outputs['hca_linkage_matrix.csv'] = buf_linkage.getvalue()
 
+    # Pairwise distance ระหว่างกลิ่นใน run นี้ (ข้อมูล standardized เดียวกับ HCA)
+    distance_df = pd.DataFrame(
+        squareform(pdist(X_scaled, metric='euclidean')) if len(X_scaled) > 1 else np.zeros((len(X_scaled), len(X_scaled))),
+        index=name_labels,
+        columns=name_labels
+    ).round(3)
+    buf_distance = io.StringIO()
+    distance_df.to_csv(buf_distance)
+    hca_outputs['smell_distance_matrix.csv'] = buf_distance.getvalue()
+
+    # --- Step 4: Separability Evaluation ---
+    eval_outputs = evaluate_separability(dataset_df) if evaluate else {}
+
     # Return all files as dict
     return {
         "sorted_labeled_data.csv": buf_sorted.getvalue(),
         "dataset.csv": buf_dataset.getvalue(),
         "average_smell_sensor_values.csv": buf_avg.getvalue(),
+        "smell_fingerprint_stats.csv": buf_stats.getvalue(),
+        "smell_window_features.csv": buf_features.getvalue(),
+        "baseline_correction.csv": pd.DataFrame([baseline_report]).to_csv(index=False),
         **radar_imgs,
         **pca_outputs,
-        **hca_outputs
+        **hca_outputs,
+        **eval_outputs
     }
 
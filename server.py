@@ -0,0 +1,22 @@
+"""
+เริ่ม Streamlit server พร้อม warm-up ทันที (ไม่ต้องรอ operator คนแรกเปิดหน้าเว็บ)
+ใช้แทน `streamlit run main.py`:  python server.py [option ของ streamlit run เช่น --server.port 8501]
+app รันใน process เดียวกัน จึงใช้ prefetch cache / tag index ที่ warm-up โหลดไว้ได้ทันที
+"""
+import os
+import sys
+from dotenv import load_dotenv
+from streamlit.web import cli as stcli
+
+if __name__ == "__main__":
+    load_dotenv()
+    import influxQueries
+    import warmup
+    try:
+        warmup.start_scheduler(influxQueries.create_client())
+    except Exception as e:
+        # เชื่อมต่อไม่ได้ตอน start: main.py จะลองเริ่ม warm-up อีกครั้งเมื่อเปิดหน้าเว็บ
+        print(f"[ERROR] Failed to start warm-up: {e}")
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    sys.argv = ["streamlit", "run", app_path] + sys.argv[1:]
+    sys.exit(stcli.main())
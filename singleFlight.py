@@ -0,0 +1,76 @@
+import re
+import threading
+from influxMetrics import InstrumentedInfluxDBClient
+
+def query_key(query, **kwargs):
+    """key ของ query: ข้อความ query ที่ตัดช่องว่างซ้ำแล้ว + bind params (รวมช่วงเวลา) + options อื่น"""
+    normalized = re.sub(r'\s+', ' ', query).strip()
+    options = tuple(sorted((k, repr(v)) for k, v in kwargs.items() if v is not None))
+    return (normalized, options)
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.abandoned = False
+        self.waiters = 0
+
+class SingleFlight:
+    """
+    รวม request ที่เหมือนกันซึ่งเกิดพร้อมกันให้เหลือการเรียกจริงครั้งเดียว
+    thread แรก (leader) เป็นคนเรียก fn ส่วน thread อื่นที่ key เดียวกันรอผลลัพธ์ชุดเดียวกัน
+    แบ่งให้ waiter เฉพาะผลลัพธ์หรือ Exception ถ้า leader ถูกหยุดด้วย BaseException (เช่น Streamlit stop/rerun
+    ของ session นั้น) waiter จะเริ่มใหม่และหนึ่งในนั้นเป็น leader แทน
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                else:
+                    call.waiters += 1
+                    self.coalesced += 1
+            if leader:
+                break
+            call.done.wait()
+            if call.abandoned:
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        except BaseException:
+            call.abandoned = True
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+# single-flight กลางของทั้ง process
+single_flight = SingleFlight()
+
+class CoalescingInfluxDBClient(InstrumentedInfluxDBClient):
+    """client ที่ใช้ร่วมกันทุก session: query ที่เหมือนกันและเกิดพร้อมกันจะเรียก InfluxDB ครั้งเดียว"""
+    def __init__(self, *args, single_flight=single_flight, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.single_flight = single_flight
+
+    def query(self, query, *args, **kwargs):
+        if args or kwargs.get('chunked'):
+            return super().query(query, *args, **kwargs)
+        key = ('query', self._database) + query_key(query, **kwargs)
+        return self.single_flight.do(key, lambda: super(CoalescingInfluxDBClient, self).query(query, **kwargs))
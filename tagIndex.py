@@ -0,0 +1,139 @@
+import bisect
+import re
+import threading
+import time
+
+# ขนาด n-gram ที่ใช้ทำ substring index (ค้นด้วยข้อความสั้นกว่านี้จะ scan แทน)
+GRAM_SIZE = 3
+
+def query_tag_values(client, measurement, key, pattern=None, limit=None, offset=0, since=None):
+    """
+    ดึงค่า tag จาก server เฉพาะที่ต้องการ
+    pattern: ข้อความที่ต้องมีอยู่ในค่า tag (case-insensitive) ให้ server กรองให้
+    limit/offset: แบ่งหน้าฝั่ง server
+    since: unix timestamp (วินาที) ดึงเฉพาะ series ที่มีข้อมูลหลังเวลานี้ (ใช้ตอน refresh)
+    """
+    conditions = []
+    if pattern:
+        regex = re.escape(pattern).replace('/', '\\/')
+        conditions.append(f'"{key}" =~ /(?i){regex}/')
+    if since is not None:
+        conditions.append(f'time > {int(since)}000ms')
+    query = f'SHOW TAG VALUES FROM "{measurement}" WITH KEY = "{key}"'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    if limit:
+        query += f' LIMIT {int(limit)}'
+        if offset:
+            query += f' OFFSET {int(offset)}'
+    result = client.query(query)
+    return [point['value'] for point in result.get_points()]
+
+class TagValueIndex:
+    """
+    index ของค่า tag (sn / sName) สำหรับ typeahead
+    - prefix search ด้วย bisect บน list ที่เรียงแบบ lowercase
+    - substring search ด้วย n-gram index
+    สร้างครั้งเดียวแล้ว refresh เฉพาะค่าใหม่ (incremental)
+    """
+    def __init__(self, measurement, key):
+        self.measurement = measurement
+        self.key = key
+        self.raw_count = 0
+        self.duplicate_count = 0
+        self.last_refresh = None
+        self._values = []
+        self._ids = {}
+        self._sorted = []
+        self._grams = {}
+        self._ordered = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, value):
+        return value in self._ids
+
+    def add(self, values):
+        """เพิ่มค่าใหม่เข้า index คืนจำนวนค่าที่ไม่เคยมีมาก่อน"""
+        new_keys = []
+        with self._lock:
+            for value in values:
+                if value in self._ids:
+                    continue
+                value_id = len(self._values)
+                self._values.append(value)
+                self._ids[value] = value_id
+                lower = value.lower()
+                new_keys.append((lower, value_id))
+                for i in range(len(lower) - GRAM_SIZE + 1):
+                    self._grams.setdefault(lower[i:i + GRAM_SIZE], set()).add(value_id)
+            if new_keys:
+                self._sorted.extend(new_keys)
+                self._sorted.sort()
+                self._ordered = None
+        return len(new_keys)
+
+    def build(self, client):
+        values = query_tag_values(client, self.measurement, self.key)
+        self.raw_count = len(values)
+        self.duplicate_count = len(values) - len(set(values))
+        self.add(values)
+        self.last_refresh = time.time()
+
+    def refresh(self, client):
+        """ดึงเฉพาะค่า tag ของ series ที่มีข้อมูลใหม่ตั้งแต่ refresh ครั้งก่อน"""
+        since = self.last_refresh
+        now = time.time()
+        added = self.add(query_tag_values(client, self.measurement, self.key, since=since))
+        self.last_refresh = now
+        return added
+
+    def ensure(self, client, max_age=300):
+        """build ครั้งแรก หรือ refresh ถ้า index เก่ากว่า max_age วินาที"""
+        if self.last_refresh is None:
+            self.build(client)
+        elif time.time() - self.last_refresh > max_age:
+            self.refresh(client)
+
+    def search(self, text="", limit=50, offset=0, sort_key=None):
+        """
+        คืน (matches, total) โดยค่าที่ขึ้นต้นด้วย text มาก่อนค่าที่มี text อยู่ตรงกลาง
+        text ว่าง = ทุกค่าเรียงตาม sort_key แบบแบ่งหน้า
+        """
+        text = (text or "").strip().lower()
+        with self._lock:
+            if not text:
+                if self._ordered is None:
+                    self._ordered = sorted(self._values, key=sort_key)
+                ordered = self._ordered
+                return ordered[offset:offset + limit], len(ordered)
+
+            lo = bisect.bisect_left(self._sorted, (text,))
+            hi = bisect.bisect_left(self._sorted, (text + '\uffff',))
+            prefix_ids = [value_id for _, value_id in self._sorted[lo:hi]]
+
+            if len(text) >= GRAM_SIZE:
+                grams = [text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)]
+                candidates = set.intersection(*(self._grams.get(g, set()) for g in grams))
+            else:
+                candidates = range(len(self._values))
+            prefix_set = set(prefix_ids)
+            substring_ids = [i for i in candidates
+                             if i not in prefix_set and text in self._values[i].lower()]
+
+            prefix = sorted((self._values[i] for i in prefix_ids), key=sort_key)
+            substring = sorted((self._values[i] for i in substring_ids), key=sort_key)
+        matches = prefix + substring
+        return matches[offset:offset + limit], len(matches)
+
+# index ของทุก measurement/key ใช้ร่วมกันทั้ง process (ทั้ง UI และ warm-up thread)
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_index(measurement, key):
+    with _indexes_lock:
+        if (measurement, key) not in _indexes:
+            _indexes[(measurement, key)] = TagValueIndex(measurement, key)
+        return _indexes[(measurement, key)]
@@ -0,0 +1,192 @@
+import json
+import os
+import threading
+import time as time_module
+from collections import Counter, OrderedDict
+from datetime import datetime, time, timedelta
+import pytz
+import influxQueries
+import tagIndex
+
+# เวลาที่ warm-up ทุกวัน (เวลา Bangkok) เช่น "07:00"
+WARMUP_TIME = os.getenv("WARMUP_TIME") or "07:00"
+# จำนวนอุปกรณ์ที่ใช้บ่อยที่สุดที่จะ prefetch
+WARMUP_TOP_DEVICES = int(os.getenv("WARMUP_TOP_DEVICES") or 10)
+USAGE_FILE = os.getenv("DEVICE_USAGE_FILE") or "device_usage.json"
+# อายุของ metadata (measurements) ที่ UI โหลดเอง (วินาที) ส่วนที่ warm-up โหลดใช้ได้จนถึง warm-up ครั้งถัดไป
+METADATA_TTL = 600
+# เวลาที่เผื่อให้ข้อมูลจากอุปกรณ์เข้ามาถึง InfluxDB (วินาที) ข้อมูลที่ใหม่กว่านี้ยังไม่ถือว่าครบ
+WARMUP_INGEST_LAG = int(os.getenv("WARMUP_INGEST_LAG") or 120)
+
+bangkok_tz = pytz.timezone('Asia/Bangkok')
+
+def default_range(now=None):
+    """ช่วงเวลาเริ่มต้นของหน้า UI: เมื่อวาน 00:00 ถึงวันนี้ 23:59 (Bangkok) เป็น unix timestamp"""
+    today = (now or datetime.now(bangkok_tz)).date()
+    start = bangkok_tz.localize(datetime.combine(today - timedelta(days=1), time(0, 0)))
+    end = bangkok_tz.localize(datetime.combine(today, time(23, 59)))
+    return int(start.timestamp()), int(end.timestamp())
+
+class DeviceUsage:
+    """นับจำนวนครั้งที่แต่ละอุปกรณ์ถูก export และบันทึกลงไฟล์เพื่อใช้ข้ามการ restart"""
+    def __init__(self, path=USAGE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self.counts = Counter()
+        if path and os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    for row in json.load(f):
+                        self.counts[(row['measurement'], row['serial_no'], row['use_station'])] = row['count']
+            except (OSError, ValueError, KeyError) as e:
+                print(f"[ERROR] Failed to load device usage: {e}")
+
+    def record(self, measurement, serial_no, use_station=False):
+        with self._lock:
+            self.counts[(measurement, serial_no, bool(use_station))] += 1
+            if not self.path:
+                return
+            rows = [{'measurement': m, 'serial_no': sn, 'use_station': st, 'count': c} for (m, sn, st), c in self.counts.items()]
+            try:
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(rows, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"[ERROR] Failed to save device usage: {e}")
+
+    def most_used(self, n=WARMUP_TOP_DEVICES):
+        with self._lock:
+            return [key for key, _ in self.counts.most_common(n)]
+
+class PrefetchCache:
+    """
+    cache กลางของ process สำหรับ metadata และข้อมูลรายนาทีของอุปกรณ์ที่ prefetch ไว้
+    ข้อมูลแต่ละอุปกรณ์ใช้ได้เฉพาะถึงนาทีสุดท้ายที่ครบแล้ว ณ เวลาที่ดึงลบ ingest_lag
+    (นาทีที่ยังไม่จบ และข้อมูลที่ยังส่งมาไม่ถึง จะถูก query ใหม่ทุกครั้ง)
+    """
+    def __init__(self, max_devices=WARMUP_TOP_DEVICES, ingest_lag=WARMUP_INGEST_LAG):
+        self.max_devices = max_devices
+        self.ingest_lag = ingest_lag
+        self._lock = threading.Lock()
+        self._frames = OrderedDict()
+        self._measurements = None
+        self.hits = 0
+
+    def set_measurements(self, measurements, ttl=METADATA_TTL):
+        with self._lock:
+            self._measurements = (list(measurements), time_module.time() + ttl)
+
+    def get_measurements(self):
+        with self._lock:
+            if self._measurements and time_module.time() < self._measurements[1]:
+                return list(self._measurements[0])
+        return None
+
+    def put(self, measurement, serial_no, use_station, start, end, df, fetched_at=None):
+        settled = int(fetched_at or time_module.time()) - self.ingest_lag
+        coverage_end = min(end, (settled // 60) * 60 - 1)
+        with self._lock:
+            key = (measurement, serial_no, bool(use_station))
+            self._frames[key] = (start, coverage_end, df)
+            self._frames.move_to_end(key)
+            while len(self._frames) > self.max_devices:
+                self._frames.popitem(last=False)
+
+    def get(self, measurement, serial_no, use_station, start, end):
+        """
+        คืน (แถวของ bucket ที่เริ่มในช่วง [นาทีของ start, end) ที่อยู่ใน cache, เวลาสุดท้ายที่ cache ครอบคลุม)
+        ถ้าเวลาที่ครอบคลุมน้อยกว่า end ผู้เรียกต้อง query ส่วนหลังจากนั้นเอง (ปกติคือช่วงหลัง warm-up)
+        ถ้า start อยู่นอกช่วงใน cache คืน None
+        """
+        with self._lock:
+            entry = self._frames.get((measurement, serial_no, bool(use_station)))
+            if entry is None:
+                return None
+            cached_start, cached_end, df = entry
+            if start < cached_start or start > cached_end:
+                return None
+            self.hits += 1
+        covered_end = min(end, cached_end)
+        mask = (df.index >= (start // 60) * 60) & (df.index < end) & (df.index <= covered_end)
+        return df[mask].copy(), covered_end
+
+class WarmupScheduler(threading.Thread):
+    """
+    thread เบื้องหลังใน server process: warm-up ทันทีที่เริ่ม และทุกวันตาม WARMUP_TIME
+    - โหลด measurements และ tag index (sn / sName) ของ measurement ที่ใช้บ่อย
+    - prefetch ข้อมูลรายนาทีช่วงเริ่มต้น (เมื่อวาน-วันนี้) ของอุปกรณ์ที่ใช้บ่อยที่สุดเข้า PrefetchCache
+    fetch_range(measurement, serial_no, start_unix, end_unix, use_station) ต้องคืน DataFrame ที่ index เป็น unix timestamp
+    """
+    def __init__(self, client, fetch_range, usage, cache, warmup_time=WARMUP_TIME, top_n=WARMUP_TOP_DEVICES):
+        super().__init__(name="warmup-scheduler", daemon=True)
+        self.client = client
+        self.fetch_range = fetch_range
+        self.usage = usage
+        self.cache = cache
+        hour, minute = (int(x) for x in warmup_time.split(':'))
+        self.warmup_time = time(hour, minute)
+        self.top_n = top_n
+        self.last_warmup = None
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def seconds_until_next(self, now=None):
+        now = now or datetime.now(bangkok_tz)
+        next_run = bangkok_tz.localize(datetime.combine(now.date(), self.warmup_time))
+        if next_run <= now:
+            next_run = bangkok_tz.localize(datetime.combine(now.date() + timedelta(days=1), self.warmup_time))
+        return (next_run - now).total_seconds()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.warm_up()
+            self._stop_event.wait(self.seconds_until_next())
+
+    def warm_up(self):
+        started = time_module.time()
+        try:
+            result = self.client.query("SHOW MEASUREMENTS")
+            # ใช้ได้จนถึง warm-up ครั้งถัดไป (เผื่อ warm-up ช้ากว่ากำหนดอีก METADATA_TTL)
+            self.cache.set_measurements([m['name'] for m in result.get_points()], self.seconds_until_next() + METADATA_TTL)
+        except Exception as e:
+            print(f"[ERROR] Warm-up failed to load measurements: {e}")
+
+        start, end = default_range()
+        devices = self.usage.most_used(self.top_n)
+        for measurement in dict.fromkeys(m for m, _, _ in devices):
+            for key in ("sn", "sName"):
+                try:
+                    tagIndex.get_index(measurement, key).ensure(self.client)
+                except Exception as e:
+                    print(f"[ERROR] Warm-up failed to load {key} index of {measurement}: {e}")
+        for measurement, serial_no, use_station in devices:
+            try:
+                fetched_at = time_module.time()
+                df = self.fetch_range(measurement, serial_no, start, end, use_station)
+                self.cache.put(measurement, serial_no, use_station, start, end, df, fetched_at)
+            except Exception as e:
+                print(f"[ERROR] Warm-up failed to prefetch {measurement}/{serial_no}: {e}")
+        self.last_warmup = datetime.now(bangkok_tz)
+        print(f"[DEBUG] Warm-up done: {len(devices)} devices in {time_module.time() - started:.1f}s")
+
+# cache และสถิติการใช้งานกลางของทั้ง process
+usage = DeviceUsage()
+prefetch_cache = PrefetchCache()
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def start_scheduler(client):
+    """เริ่ม WarmupScheduler ครั้งเดียวต่อ process (เรียกซ้ำได้) คืน scheduler ที่ทำงานอยู่"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            def fetch_range(measurement, serial_no, start_unix, end_unix, use_station):
+                query, bind_params = influxQueries.build_query(measurement, serial_no, start_unix, end_unix, use_station)
+                return influxQueries.result_to_dataframe(client.query(query, bind_params=bind_params))
+            _scheduler = WarmupScheduler(client, fetch_range, usage, prefetch_cache)
+            _scheduler.start()
+        return _scheduler